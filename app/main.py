@@ -5,8 +5,15 @@ from .routes import bp
 
 from flask import Flask
 from .routes import bp as routes_bp
+from .utils.model_registry import registry
+from .utils.pdf_export import report_renderer
+from .utils.metrics import metrics
 import os
 
+# Models load on first use unless NEPHROSCAN_PRELOAD=1 (gunicorn.conf.py sets it so
+# the master loads them once before forking workers)
+PRELOAD_MODELS = os.environ.get("NEPHROSCAN_PRELOAD", "0") == "1"
+
 def create_app():
     # Make sure Flask knows where the 'static' folder is
     app = Flask(__name__,
@@ -15,5 +22,11 @@ def create_app():
 
     app.secret_key = "super-secret-key"
     app.register_blueprint(routes_bp)
+    report_renderer.init_app(app)
+    metrics.init_app(app)
+
+    if PRELOAD_MODELS:
+        registry.load_all()
+    metrics.record_startup()
 
     return app
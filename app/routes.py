@@ -1,28 +1,56 @@
-from flask import Blueprint, request, render_template, session, redirect, url_for, jsonify
-from .utils.classification import load_classifier
-from .utils.localization import localize_kidney, map_coordinates_to_regions
-from .utils.report import generate_medical_report
-from .utils.chatbot import chatbot_response
+from flask import Blueprint, Response, stream_with_context, request, render_template, session, redirect, url_for, jsonify, send_file
+from .utils.model_registry import registry
+from .utils.batching import classifier_service
+from .utils.pipeline import run_analysis
+from .utils.jobs import result_store, job_queue, QueueFull, sse_format
+from .utils.result_cache import result_cache
+from .utils.speculation import speculative_localizer
+from .utils.artifacts import artifact_store
+from .utils.localization import map_coordinates_to_regions
+from .utils.report import generate_study_report
+from .utils.study import iter_study_slices, analyze_study
+from .utils.chatbot import chatbot_response, iter_chatbot_response, chat_cache_stats
 from .utils.risk_model import predict_kidney_risk
+from .utils.pdf_export import (report_renderer, report_context, export_queue, export_reports, export_path,
+                               PdfUnavailable, EXPORT_MAX_REPORTS)
+from .utils.metrics import metrics, span
+from .utils.risk_bulk import BulkInputError, detect_format, score_stream, guarded, iter_csv, iter_ndjson
 
-import torch
-from torchvision import transforms
-from PIL import Image
 import os
-import glob
-import time
-import re
 import logging
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import numpy as np
 from datetime import datetime
 
 bp = Blueprint('routes', __name__)
-classifier = load_classifier()
+
+# Longest a single job event stream stays open before the client reconnects
+JOB_STREAM_SECONDS = int(os.environ.get("NEPHROSCAN_JOB_STREAM_SECONDS", "20"))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Gauges read at scrape time by /metrics
+metrics.gauge("nephroscan_model_load_seconds", "Time taken to load and warm up each model",
+              lambda: {name: s["load_seconds"] for name, s in registry.status().items()}, "model")
+metrics.gauge("nephroscan_job_queue_depth", "Analysis jobs waiting for a worker",
+              lambda: job_queue.stats()["queue_depth"])
+metrics.gauge("nephroscan_export_queue_depth", "Report exports waiting for a worker",
+              lambda: export_queue.stats()["queue_depth"])
+metrics.gauge("nephroscan_classifier_queue_depth", "Images waiting for the next classifier batch",
+              lambda: classifier_service.stats()["queue_depth"])
+metrics.gauge("nephroscan_encoder_queue_depth", "Chat queries waiting for the next embedding batch",
+              lambda: chat_cache_stats()["encoder"]["queue_depth"])
+metrics.gauge("nephroscan_result_cache_hit_rate", "Hit rate of the analysis result cache",
+              lambda: result_cache.stats()["hit_rate"])
+metrics.gauge("nephroscan_result_cache_entries", "Analysis results cached per tier",
+              lambda: {"memory": result_cache.stats()["memory_entries"], "disk": result_cache.stats()["disk_entries"]},
+              "tier")
+metrics.gauge("nephroscan_chat_cache_hit_rate", "Hit rate of the chat query caches",
+              lambda: {name: s["hit_rate"] for name, s in chat_cache_stats().items() if name in ("embeddings", "retrieval")},
+              "cache")
+metrics.gauge("nephroscan_report_cache_entries", "PDF reports cached on disk",
+              lambda: report_renderer.stats()["cached_reports"])
+metrics.gauge("nephroscan_artifact_bytes", "Bytes of indexed artifacts under static/ by kind",
+              lambda: {kind: s["bytes"] for kind, s in artifact_store.stats().items()}, "kind")
+
 @bp.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
@@ -31,62 +59,15 @@ def index():
 
         if image_file and image_file.filename != "":
             try:
-                # Save uploaded image
-                upload_dir = "static/uploaded"
-                os.makedirs(upload_dir, exist_ok=True)
-                original_filename = os.path.splitext(image_file.filename)[0]
-                safe_filename = re.sub(r'[^a-zA-Z0-9_-]', '', original_filename) + ".png"
-                image_path = os.path.join(upload_dir, safe_filename)
-                image_file.save(image_path)
-
-                # Classify
-                image = Image.open(image_path).convert("RGB")
-                transform = transforms.Compose([
-                    transforms.Resize((224, 224)),
-                    transforms.ToTensor(),
-                    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-                ])
-                input_tensor = transform(image).unsqueeze(0)
-                with torch.no_grad():
-                    output = classifier(input_tensor)
-                    pred_idx = torch.argmax(output).item()
-                    labels = ["cyst", "normal", "stone", "tumor"]
-                    predicted_label = labels[pred_idx]
-
-                # Localization if abnormal
-                boxes = []
-                localized_image_url = None
-                if predicted_label != "normal":
-                    output_folder = os.path.join("static", "localized")
-                    os.makedirs(output_folder, exist_ok=True)
-
-                    # Cleanup old
-                    for f in glob.glob(os.path.join(output_folder, "*_localized.png")):
-                        try:
-                            os.remove(f)
-                        except Exception:
-                            continue
-
-                    # YOLOv8 localization with region labels
-                    boxes, localized_image = localize_kidney(image_path)
-
-                    timestamp = int(time.time())
-                    localized_filename = f"{safe_filename}_{timestamp}_localized.png"
-                    localized_path = os.path.join(output_folder, localized_filename)
-
-                    # Save the image with annotations (rectangle, region name)
-                    localized_image.save(localized_path)
-
-                    localized_image_url = os.path.join("localized", localized_filename).replace("\\", "/")
-
-                # Report
-                report = generate_medical_report(predicted_label, len(boxes))
-
-                # Store in session
-                session["label"] = predicted_label
-                session["report"] = report
-                session["boxes"] = boxes
-                session["localized_image_url"] = localized_image_url
+                with span("upload.read"):
+                    data = image_file.read()
+                result = run_analysis(data, image_file.filename)
+                predicted_label = result["label"]
+                boxes = result["boxes"]
+
+                # Keep the result server-side; the cookie only carries its id
+                with span("upload.store"):
+                    session["analysis_id"] = result_store.put(result, key=result["analysis_id"])
 
                 # Log for debugging
                 logging.info(f"Processed image - Label: {predicted_label}, Boxes: {boxes}")
@@ -99,22 +80,107 @@ def index():
 
         return render_template("index.html", error="No image selected.", label=None)
 
-    return render_template("index.html", label=session.get("label"))
+    analysis = result_store.get(session.get("analysis_id"))
+    return render_template("index.html", label=analysis["label"] if analysis else None)
+
+def _analyze_job(data, filename, results_url, progress):
+    result = run_analysis(data, filename, progress)
+    analysis_id = result_store.put(result, key=result["analysis_id"])
+    return dict(result, analysis_id=analysis_id, results_url=f"{results_url}?id={analysis_id}")
+
+@bp.route("/api/analyze", methods=["POST"])
+def analyze_async():
+    image_file = request.files.get("image")
+    if not image_file or image_file.filename == "":
+        return jsonify({"error": "No image selected."}), 400
+
+    # Read the upload here; the request stream is gone once we return
+    data = image_file.read()
+    try:
+        job = job_queue.submit(_analyze_job, data, image_file.filename, url_for("routes.results"))
+    except QueueFull:
+        return jsonify({"error": "Analysis queue is full, please retry shortly."}), 429, {"Retry-After": "5"}
+
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for("routes.job_status", job_id=job.id),
+        "events_url": url_for("routes.job_events", job_id=job.id),
+    }), 202
+
+@bp.route("/api/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@bp.route("/api/jobs/<job_id>/events")
+def job_events(job_id):
+    """
+    Progress of an analysis job as Server-Sent Events. Each connection is
+    closed after JOB_STREAM_SECONDS, so a waiting client holds a worker
+    thread only briefly; EventSource reconnects on its own (after `retry`
+    ms) and resumes from the Last-Event-ID it sends, on any worker.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    after = request.headers.get("Last-Event-ID", request.args.get("after", "0"))
+    after = int(after) if after.isdigit() else 0
+
+    def stream():
+        yield "retry: 1000\n\n"
+        for event in job.iter_events(after, max_seconds=JOB_STREAM_SECONDS):
+            yield sse_format(event)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@bp.route("/api/jobs")
+def job_queue_stats():
+    return jsonify(job_queue.stats())
+
+@bp.route("/api/study", methods=["POST"])
+def analyze_study_upload():
+    # Accept a zip archive and/or a directory-style multi-file upload
+    files = request.files.getlist("study") + request.files.getlist("images")
+    if not any(f and f.filename for f in files):
+        return jsonify({"error": "No study uploaded"}), 400
+
+    try:
+        study = analyze_study(iter_study_slices(files))
+    except Exception as e:
+        logging.error(f"Error processing study: {str(e)}")
+        return jsonify({"error": "Processing failed."}), 500
+
+    if study["num_slices"] == 0:
+        return jsonify({"error": "No readable image slices found"}), 400
+
+    study["report"] = generate_study_report(study)
+    logging.info(f"Processed study - Verdict: {study['verdict']}, Slices: {study['num_slices']}")
+    return jsonify(study)
 
 @bp.route("/redirect")
 def redirect_after_alert():
     return render_template("redirect.html")
 
+def _current_analysis():
+    # ?id= lets clients of /api/analyze open the results page for their job
+    analysis_id = request.args.get("id") or session.get("analysis_id")
+    return result_store.get(analysis_id)
+
 @bp.route("/results")
 def results():
-    label = session.get("label")
-    report = session.get("report")
-    boxes = session.get("boxes", [])
-    localized_image_url = session.get("localized_image_url")
-
-    if label is None:
+    analysis = _current_analysis()
+    if analysis is None:
         return redirect(url_for("routes.index"))
 
+    label = analysis["label"]
+    report = analysis["report"]
+    boxes = analysis["boxes"]
+    localized_image_url = analysis["localized_image_url"]
+
     # Convert boxes to region names
     regions = map_coordinates_to_regions(boxes)
 
@@ -126,30 +192,79 @@ def results():
                           report=report,
                           regions=regions,
                           localized_image_url=localized_image_url,
+                          renditions=analysis.get("renditions"),
+                          boxes=boxes,
+                          image_size=analysis.get("image_size"),
                           current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
 @bp.route("/pdf_preview")
 def pdf_preview():
-    label = session.get("label")
-    report = session.get("report")
-    boxes = session.get("boxes", [])
-    localized_image_url = session.get("localized_image_url")
-
-    if label is None:
+    analysis = _current_analysis()
+    if analysis is None:
         return redirect(url_for("routes.index"))
 
-    # Convert boxes to region names
-    regions = map_coordinates_to_regions(boxes)
+    context = report_context(analysis)
 
     # Log for debugging
-    logging.info(f"PDF Preview - Label: {label}, Regions: {regions}, Image URL: {localized_image_url}")
-
-    return render_template("report_pdf.html",
-                          label=label,
-                          report=report,
-                          regions=regions,
-                          localized_image_url=localized_image_url,
-                          current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    logging.info(f"PDF Preview - Label: {context['label']}, Regions: {context['regions']}, Image URL: {context['localized_image_url']}")
+
+    return report_renderer.render_html(context)
+
+@bp.route("/report.pdf")
+def report_pdf():
+    analysis = _current_analysis()
+    if analysis is None:
+        return jsonify({"error": "Unknown or expired analysis"}), 404
+
+    try:
+        path = report_renderer.render(report_context(analysis))
+    except PdfUnavailable as e:
+        return jsonify({"error": f"Server-side PDF export is unavailable: {str(e)}"}), 503
+    except Exception as e:
+        logging.error(f"PDF export failed: {str(e)}")
+        return jsonify({"error": "PDF export failed."}), 500
+
+    return send_file(path, mimetype="application/pdf", as_attachment=True,
+                     download_name=f"NephroScan_Report_{analysis['label']}.pdf", max_age=3600)
+
+@bp.route("/api/reports/export", methods=["POST"])
+def export_reports_zip():
+    ids = (request.get_json(silent=True) or {}).get("ids") or request.form.getlist("ids")
+    if not ids:
+        return jsonify({"error": "No analysis ids provided"}), 400
+    if len(ids) > EXPORT_MAX_REPORTS:
+        return jsonify({"error": f"At most {EXPORT_MAX_REPORTS} reports per export"}), 400
+
+    # Results are looked up now; the zip itself is written on the export worker
+    analyses = [(analysis_id, result_store.get(analysis_id)) for analysis_id in dict.fromkeys(ids)]
+    try:
+        job = export_queue.submit(export_reports, analyses)
+    except QueueFull:
+        return jsonify({"error": "Export queue is full, please retry shortly."}), 429, {"Retry-After": "30"}
+
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for("routes.export_status", job_id=job.id),
+    }), 202
+
+@bp.route("/api/reports/export/<job_id>")
+def export_status(job_id):
+    job = export_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    status = job.to_dict()
+    if job.status == "done":
+        status["download_url"] = url_for("routes.export_download", job_id=job.id)
+    return jsonify(status)
+
+@bp.route("/api/reports/export/<job_id>/download")
+def export_download(job_id):
+    job = export_queue.get(job_id)
+    path = export_path(job.result["archive"]) if job is not None and job.status == "done" else None
+    if path is None:
+        return jsonify({"error": "Export not found or not finished"}), 404
+    return send_file(path, mimetype="application/zip", as_attachment=True, download_name=job.result["archive"])
 
 @bp.route("/chat", methods=["POST"])
 def chat():
@@ -159,6 +274,29 @@ def chat():
     response = chatbot_response(user_input)
     return jsonify({"response": response})
 
+@bp.route("/chat/stream", methods=["GET", "POST"])
+def chat_stream():
+    """
+    Server-Sent Events version of /chat: the intent arrives first, then each
+    retrieved passage as soon as it is ranked. The view returns a lazy
+    generator that holds a worker thread only while the answer is produced,
+    which takes about as long as a plain /chat request.
+    """
+    user_input = request.values.get("message") or (request.get_json(silent=True) or {}).get("message")
+    if not user_input:
+        return jsonify({"error": "No message provided"}), 400
+
+    def events():
+        try:
+            for event in iter_chatbot_response(user_input):
+                yield sse_format(event, name_key="event")
+        except Exception as e:
+            logging.error(f"Chat stream failed: {str(e)}")
+            yield sse_format({"event": "error", "error": "Chat failed."}, name_key="event")
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @bp.route("/risk-quiz", methods=["GET", "POST"])
 def risk_quiz():
     prediction = None
@@ -169,16 +307,100 @@ def risk_quiz():
             prediction, explanation = predict_kidney_risk(request.form)
         except ValueError as e:
             error = str(e)
-    return render_template("risk_quiz.html", prediction=prediction, explanation=explanation, error=error)
+    with span("risk.render"):
+        return render_template("risk_quiz.html", prediction=prediction, explanation=explanation, error=error)
+
+@bp.route("/api/risk/bulk", methods=["POST"])
+def risk_bulk():
+    """
+    Score a CSV or JSON array of urine panels, uploaded as the 'file' form
+    field or as the raw request body. Results stream back one row at a time
+    (CSV for CSV input, NDJSON otherwise; ?output=csv|ndjson overrides).
+    """
+    upload = request.files.get("file")
+    if upload and upload.filename:
+        source = upload.stream
+        input_format = request.args.get("format") or detect_format(upload.filename, upload.content_type)
+    else:
+        source = request.stream
+        input_format = request.args.get("format") or detect_format(content_type=request.content_type)
+    if input_format not in ("csv", "json"):
+        return jsonify({"error": "Upload a .csv or .json file, or pass ?format=csv|json"}), 400
+
+    output_format = request.args.get("output") or ("csv" if input_format == "csv" else "ndjson")
+    if output_format == "csv":
+        writer, mimetype = iter_csv, "text/csv"
+    else:
+        writer, mimetype = iter_ndjson, "application/x-ndjson"
+
+    results = score_stream(source, input_format)
+    try:
+        # Pull the first row now so a bad header is a 400 rather than a 200 with an error row
+        first = next(results, None)
+    except BulkInputError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def rows():
+        if first is not None:
+            yield first
+        yield from guarded(results)
+
+    return Response(stream_with_context(writer(rows())), mimetype=mimetype,
+                    headers={"X-Accel-Buffering": "no"})
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/api/models")
+def model_status():
+    # 503 only when some model failed to load; models that load on first use
+    # count as ready, "loaded" says which ones already have
+    ready = registry.is_ready()
+    body = {"ready": ready, "loaded": registry.is_loaded(), "models": registry.status()}
+    return jsonify(body), 200 if ready else 503
+
+@bp.route("/api/classifier-stats")
+def classifier_stats():
+    return jsonify(classifier_service.stats())
+
+@bp.route("/api/cache-stats")
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@bp.route("/api/chat-cache-stats")
+def chat_cache_statistics():
+    return jsonify(chat_cache_stats())
+
+@bp.route("/api/speculation-stats")
+def speculation_stats():
+    return jsonify(speculative_localizer.stats())
+
+@bp.route("/api/report-stats")
+def report_stats():
+    return jsonify(dict(report_renderer.stats(), export_queue=export_queue.stats()))
 
 @bp.route("/api/localized-images")
 def get_localized_images():
-    folder = os.path.join("static", "localized")
-    image_files = [
-        f for f in sorted(
-            os.listdir(folder),
-            key=lambda x: os.path.getmtime(os.path.join(folder, x)),
-            reverse=True
-        ) if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-    ]
-    return jsonify(image_files)
\ No newline at end of file
+    # Served from the artifact index, newest first. Annotated PNGs are listed by
+    # file name; in client overlay mode the scans are renditions without burned-in
+    # boxes, listed as {"file", "boxes", "image_size"} so the boxes can be drawn.
+    # ?page=&per_page= paginate it, with the totals in headers.
+    paginated = "page" in request.args or "per_page" in request.args
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 50, type=int) if paginated else None
+    listing = artifact_store.list(("localized", "rendition"), page, per_page)
+    response = jsonify([
+        os.path.basename(item["path"]) if item["kind"] == "localized"
+        else dict(item["meta"] or {}, file=os.path.basename(item["path"]))
+        for item in listing["items"]
+    ])
+    response.headers["X-Total-Count"] = str(listing["total"])
+    if paginated:
+        response.headers["X-Page"] = str(listing["page"])
+        response.headers["X-Per-Page"] = str(listing["per_page"])
+    return response
+
+@bp.route("/api/artifacts/<analysis_id>")
+def get_analysis_artifacts(analysis_id):
+    return jsonify(artifact_store.owned_by(analysis_id))
@@ -0,0 +1,200 @@
+# app/utils/artifacts.py
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+STATIC_DIR = "static"
+ARTIFACT_DB = os.environ.get("NEPHROSCAN_ARTIFACT_DB", os.path.join("cache", "artifacts.sqlite3"))
+ARTIFACT_TTL_SECONDS = int(os.environ.get("NEPHROSCAN_ARTIFACT_TTL_SECONDS", str(24 * 3600)))
+ARTIFACT_MAX_MB = int(os.environ.get("NEPHROSCAN_ARTIFACT_MAX_MB", "1024"))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get("NEPHROSCAN_ARTIFACT_SWEEP_SECONDS", "300"))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+
+class ArtifactStore:
+    """
+    SQLite index of the images written under static/ (uploads, annotated
+    scans). Each artifact records the analysis that owns it, so nothing is
+    deleted from under a concurrent user; an analysis served from the result
+    cache is linked to the artifacts it reuses. Artifacts can carry JSON
+    metadata (the boxes drawn over a rendition). A background sweeper evicts by TTL
+    and then by total size, oldest first; listings are served from the index
+    instead of directory scans.
+    """
+
+    def __init__(self, db_path=ARTIFACT_DB, root=STATIC_DIR, ttl=ARTIFACT_TTL_SECONDS,
+                 max_bytes=ARTIFACT_MAX_MB * 1024 * 1024, sweep_interval=SWEEP_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def _db(self):
+        if self._conn is None:
+            if self.db_path != ":memory:":
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                " path TEXT PRIMARY KEY, kind TEXT NOT NULL, analysis_id TEXT,"
+                " size INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_kind_created ON artifacts (kind, created)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_owner ON artifacts (analysis_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_created ON artifacts (created)")
+            # Further analyses using an artifact (result-cache hits)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifact_owners ("
+                " path TEXT NOT NULL, analysis_id TEXT NOT NULL, PRIMARY KEY (path, analysis_id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifact_owners_owner ON artifact_owners (analysis_id)")
+            try:
+                self._conn.execute("ALTER TABLE artifacts ADD COLUMN meta TEXT")
+            except sqlite3.OperationalError:
+                pass  # index created with the column
+        return self._conn
+
+    def add(self, rel_path, kind, analysis_id=None, size=None, meta=None):
+        """Index a file that was written to root/rel_path."""
+        if size is None:
+            size = os.path.getsize(os.path.join(self.root, rel_path))
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO artifacts (path, kind, analysis_id, size, created, meta) VALUES (?, ?, ?, ?, ?, ?)",
+                (rel_path.replace("\\", "/"), kind, analysis_id, size, time.time(),
+                 json.dumps(meta) if meta is not None else None)
+            )
+        self._ensure_sweeper()
+
+    def link(self, rel_paths, analysis_id):
+        """Record that analysis_id also uses these artifacts; they count as new for the TTL."""
+        paths = [p.replace("\\", "/") for p in rel_paths]
+        with self._lock:
+            db = self._db()
+            db.executemany("INSERT OR IGNORE INTO artifact_owners (path, analysis_id) VALUES (?, ?)",
+                           [(p, analysis_id) for p in paths])
+            db.executemany("UPDATE artifacts SET created = ? WHERE path = ?", [(time.time(), p) for p in paths])
+
+    def list(self, kinds, page=1, per_page=50):
+        """Newest first; kinds is one kind or a tuple; per_page=None returns every match."""
+        if isinstance(kinds, str):
+            kinds = (kinds,)
+        where = f"kind IN ({', '.join('?' * len(kinds))})"
+        page = max(1, page)
+        if per_page is not None:
+            per_page = max(1, min(per_page, 500))
+        with self._lock:
+            db = self._db()
+            total = db.execute(f"SELECT COUNT(*) FROM artifacts WHERE {where}", kinds).fetchone()[0]
+            rows = db.execute(
+                f"SELECT path, kind, analysis_id, size, created, meta FROM artifacts WHERE {where}"
+                " ORDER BY created DESC LIMIT ? OFFSET ?",
+                (*kinds, -1 if per_page is None else per_page, 0 if per_page is None else (page - 1) * per_page)
+            ).fetchall()
+        items = [{"path": p, "kind": k, "analysis_id": a, "size": s, "created": c, "meta": json.loads(m) if m else None}
+                 for p, k, a, s, c, m in rows]
+        return {"items": items, "page": page, "per_page": per_page, "total": total}
+
+    def owned_by(self, analysis_id):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT path, kind FROM artifacts WHERE analysis_id = ?"
+                " OR path IN (SELECT path FROM artifact_owners WHERE analysis_id = ?) ORDER BY created",
+                (analysis_id, analysis_id)
+            ).fetchall()
+        return [{"path": p, "kind": k} for p, k in rows]
+
+    def _delete(self, paths):
+        for path in paths:
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Failed to delete artifact {path}: {str(e)}")
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM artifacts WHERE path = ?", [(p,) for p in paths])
+            db.executemany("DELETE FROM artifact_owners WHERE path = ?", [(p,) for p in paths])
+
+    def sweep(self):
+        """Evict expired artifacts, then the oldest ones until under max_bytes."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            db = self._db()
+            expired = [r[0] for r in db.execute("SELECT path FROM artifacts WHERE created < ?", (cutoff,))]
+        self._delete(expired)
+
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            victims = []
+            if total > self.max_bytes:
+                for path, size in db.execute("SELECT path, size FROM artifacts ORDER BY created"):
+                    victims.append(path)
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+        self._delete(victims)
+        return len(expired) + len(victims)
+
+    def reconcile(self, folders=(("localized", "localized"), ("uploaded", "uploaded"))):
+        """One-off import of files written before the index existed."""
+        for folder, kind in folders:
+            directory = os.path.join(self.root, folder)
+            if not os.path.isdir(directory):
+                continue
+            with self._lock:
+                known = {r[0] for r in self._db().execute("SELECT path FROM artifacts WHERE kind = ?", (kind,))}
+            rows = []
+            for entry in os.scandir(directory):
+                rel_path = f"{folder}/{entry.name}"
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS) and rel_path not in known:
+                    st = entry.stat()
+                    rows.append((rel_path, kind, None, st.st_size, st.st_mtime))
+            with self._lock:
+                self._db().executemany(
+                    "INSERT OR IGNORE INTO artifacts (path, kind, analysis_id, size, created) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="artifact-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            logging.error(f"Artifact reconcile failed: {str(e)}")
+        while True:
+            try:
+                removed = self.sweep()
+                if removed:
+                    logging.info(f"Artifact sweep removed {removed} file(s)")
+            except Exception as e:
+                logging.error(f"Artifact sweep failed: {str(e)}")
+            time.sleep(self.sweep_interval)
+
+    def stats(self):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM artifacts GROUP BY kind"
+            ).fetchall()
+        return {kind: {"count": count, "bytes": size} for kind, count, size in rows}
+
+
+artifact_store = ArtifactStore()
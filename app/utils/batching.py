@@ -0,0 +1,45 @@
+# app/utils/batching.py
+import os
+
+from .microbatch import MicroBatcher
+from .model_registry import registry, CLASS_LABELS
+
+BATCH_WINDOW_MS = float(os.environ.get("NEPHROSCAN_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.environ.get("NEPHROSCAN_MAX_BATCH_SIZE", "16"))
+
+
+class BatchedClassifier(MicroBatcher):
+    """
+    Dynamic micro-batching in front of ResNetWithDropout.
+    Callers submit a single preprocessed (3, 224, 224) tensor; a background
+    thread gathers requests for up to `window_ms` or `max_batch_size` items,
+    runs one forward pass and resolves each caller's future with
+    (label, {class: probability}).
+    """
+
+    name = "classifier-batcher"
+
+    def __init__(self, model_getter, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE, labels=CLASS_LABELS):
+        super().__init__(window_ms, max_batch_size)
+        self._model_getter = model_getter
+        self.labels = labels
+
+    def submit(self, input_tensor):
+        if input_tensor.dim() == 4:
+            input_tensor = input_tensor.squeeze(0)
+        return super().submit(input_tensor)
+
+    def classify(self, input_tensor, timeout=None):
+        return self.submit(input_tensor).result(timeout=timeout)
+
+    def process(self, tensors):
+        import torch
+
+        model = self._model_getter()
+        with torch.no_grad():
+            output = model(torch.stack(tensors))
+            probs = torch.softmax(output, dim=1).tolist()
+        return [(self.labels[max(range(len(p)), key=p.__getitem__)], dict(zip(self.labels, p))) for p in probs]
+
+
+classifier_service = BatchedClassifier(lambda: registry.get("classifier"))
@@ -1,59 +1,99 @@
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-import os
-from textblob import TextBlob
-from fuzzywuzzy import fuzz
 import re
+import time
+import threading
+from .model_registry import registry, checkpoint_fingerprint
+from .rag_store import index_paths
+from .query_cache import TTLCache, EncodeCoalescer, normalize_query
+from .lexical import PathStats, reciprocal_rank_fusion
+from .metrics import span
 
-# Load the context (text file) content
-def load_context():
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    CONTEXT_PATH = os.path.join(BASE_DIR, "../../rag/index_documents.txt")
-    with open(CONTEXT_PATH, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f if line.strip()]
+# Chunk texts (legacy list or memory-mapped ChunkStore) and the FAISS index
+# both live in the model registry, keyed by the same chunk ids.
 
-# Initialize the embedder
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+# Query caches, invalidated whenever the FAISS index file changes
+embedding_cache = TTLCache()
+retrieval_cache = TTLCache()
+encoder = EncodeCoalescer(lambda: registry.get("embedder"))
+retrieval_stats = PathStats()
+INDEX_CHECK_SECONDS = 5.0
+_index_state = {"version": checkpoint_fingerprint(*index_paths()), "checked": time.monotonic()}
+_index_lock = threading.Lock()
 
-# Load the context documents
-context_docs = load_context()
+def _check_index_version():
+    now = time.monotonic()
+    if now - _index_state["checked"] < INDEX_CHECK_SECONDS:
+        return
+    with _index_lock:
+        _index_state["checked"] = now
+        version = checkpoint_fingerprint(*index_paths())
+        if version == _index_state["version"]:
+            return
+        _index_state["version"] = version
+        registry.invalidate("faiss_index")
+        registry.invalidate("rag_chunks")
+        registry.invalidate("lexical_index")
+        retrieval_cache.clear()
 
-# Initialize FAISS index
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-RAG_DIR = os.path.join(BASE_DIR, "../../rag/")
-INDEX_PATH = os.path.join(RAG_DIR, "faiss_index.faiss")
-index = faiss.read_index(INDEX_PATH)
+def embed_query(query):
+    """Embedding for a normalized query: cache first, then a coalesced encode."""
+    vector = embedding_cache.get(query)
+    if vector is None:
+        vector = encoder.encode(query)
+        embedding_cache.put(query, vector)
+    return vector
 
-# Function for spelling correction using TextBlob
+# Spelling correction with the precomputed symmetric-delete index
+# (nephrology terms are in its dictionary, so they are left alone)
 def correct_spelling(user_input):
-    blob = TextBlob(user_input)
-    corrected = blob.correct()
-    return str(corrected)
-
-# Function for fuzzy matching
-def fuzzy_match(query, options, threshold=80):
-    best_match = None
-    highest_score = 0
-    for option in options:
-        score = fuzz.ratio(query.lower(), option.lower())
-        if score > highest_score and score >= threshold:
-            highest_score = score
-            best_match = option
-    return best_match
+    return registry.get("spell_checker").correct(user_input)
 
 # Retrieve context based on user query
-def retrieve_context(query, top_k=3):
-    query_embedding = embedder.encode([query])
-    D, I = index.search(np.array(query_embedding), top_k)
-    results = [context_docs[i] for i in I[0]]
+def retrieve_context(query, top_k=3, query_embedding=None):
+    """
+    query_embedding: embedding of the normalized query when the caller has
+    already computed it (the intent router does), so it is not encoded twice.
+    """
+    _check_index_version()
+    key = (normalize_query(query), top_k)
+    results = retrieval_cache.get(key)
+    if results is not None:
+        return list(results)
+
+    started = time.perf_counter()
+    chunks = registry.get("rag_chunks")
+
+    # Lexical fast path: confident keyword matches skip the dense search
+    # (and the embedder, when no embedding was passed in)
+    lexical = registry.get("lexical_index")
+    hits, coverage, margin = lexical.search(key[0], top_k * 2)
+    if hits and lexical.is_confident(coverage, margin):
+        ids = [doc_id for doc_id, _ in hits[:top_k]]
+        path = "lexical"
+    else:
+        index = registry.get("faiss_index")
+        if query_embedding is None:
+            query_embedding = embed_query(key[0])
+        D, I = index.search(query_embedding.reshape(1, -1), top_k * 2 if hits else top_k)
+        dense = [int(i) for i in I[0] if i >= 0]
+        if hits:
+            ids = reciprocal_rank_fusion([dense, [doc_id for doc_id, _ in hits]], top_k)
+            path = "fused"
+        else:
+            ids = dense[:top_k]
+            path = "dense"
+
+    results = [chunks[i] for i in ids]
+    retrieval_stats.record(path, time.perf_counter() - started)
+    retrieval_cache.put(key, tuple(results))
     return results
 
-# Detect if input is location-related
-def get_user_location(user_input):
-    location_keywords = ["city", "town", "place", "area", "near me", "location"]
-    matched_location = fuzzy_match(user_input, location_keywords)
-    return bool(matched_location)
+def chat_cache_stats():
+    return {
+        "embeddings": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "encoder": encoder.stats(),
+        "retrieval_paths": retrieval_stats.stats(),
+    }
 
 # Extract location from phrases like 'near manipal', 'in bangalore'
 def extract_possible_location(user_input):
@@ -62,32 +102,53 @@ def extract_possible_location(user_input):
         return match.group(2).strip().title()
     return user_input.title()
 
+DISEASE_INFO = {
+    "cyst": "- What is a Kidney Cyst?\n- A kidney cyst is a fluid-filled sac that forms within the kidney. Most are benign but may cause symptoms if infected or large.\n- How is a Kidney Cyst Treated?\n- Most kidney cysts require no treatment unless symptomatic. Large cysts may require aspiration or surgery.",
+    "stone": "- What is a Kidney Stone?\n- A kidney stone is a solid mineral deposit formed in the kidneys. They may cause severe pain when moving through the urinary tract.\n- How are Kidney Stones Treated?\n- Treatment includes hydration, pain control, and possibly procedures like lithotripsy or surgery.",
+    "tumor": "- What is a Renal Tumor?\n- A kidney tumor may be benign or malignant. RCC is the most common cancer.\n- How are Renal Tumors Treated?\n- Treatment includes surgery, ablation, or immunotherapy based on staging.",
+    "cancer": "- What is Kidney Cancer?\n- It includes various malignancies in the kidney.\n- Treatment usually involves surgery and systemic therapy.",
+    "kidney": "- What is the Function of the Kidney?\n- Kidneys filter blood and manage electrolytes.\n- Common conditions: infections, stones, cysts, tumors."
+}
+
 # Main chatbot logic (map functionality removed)
-def chatbot_response(user_input):
-    corrected_input = correct_spelling(user_input)
-    response = {"text": ""}
+def iter_chatbot_response(user_input):
+    """
+    Streaming form of chatbot_response. Yields event dicts:
+    {"event": "meta", ...} once routing is done, then {"event": "delta",
+    "text": ...} pieces whose concatenation is the full answer (retrieved
+    passages are sent one by one as soon as they are ranked), and finally
+    {"event": "done"}.
+    """
+    with span("chat.spelling"):
+        corrected_input = correct_spelling(user_input)
+
+    # One encode per message, shared by intent routing and retrieval
+    query = normalize_query(corrected_input)
+    with span("chat.embed"):
+        query_embedding = embed_query(query)
+    with span("chat.intent"):
+        intent, _ = registry.get("intent_router").route(query_embedding)
+    yield {"event": "meta", "intent": intent, "corrected": corrected_input}
 
     # Step 1: Ask for location if general location intent is detected
-    if get_user_location(corrected_input):
-        response["text"] = "🧠 I see you're looking for nephrologists near you. Please specify your location (e.g., 'Bangalore', 'New York')."
-        return response
-
-    # Step 2: Detect disease-related keywords
-    medical_keywords = ["cyst", "kidney", "disease", "tumor", "stone", "cancer"]
-    matched_term = fuzzy_match(corrected_input, medical_keywords)
-    if matched_term:
-        disease_info = {
-            "cyst": "- What is a Kidney Cyst?\n- A kidney cyst is a fluid-filled sac that forms within the kidney. Most are benign but may cause symptoms if infected or large.\n- How is a Kidney Cyst Treated?\n- Most kidney cysts require no treatment unless symptomatic. Large cysts may require aspiration or surgery.",
-            "stone": "- What is a Kidney Stone?\n- A kidney stone is a solid mineral deposit formed in the kidneys. They may cause severe pain when moving through the urinary tract.\n- How are Kidney Stones Treated?\n- Treatment includes hydration, pain control, and possibly procedures like lithotripsy or surgery.",
-            "tumor": "- What is a Renal Tumor?\n- A kidney tumor may be benign or malignant. RCC is the most common cancer.\n- How are Renal Tumors Treated?\n- Treatment includes surgery, ablation, or immunotherapy based on staging.",
-            "cancer": "- What is Kidney Cancer?\n- It includes various malignancies in the kidney.\n- Treatment usually involves surgery and systemic therapy.",
-            "kidney": "- What is the Function of the Kidney?\n- Kidneys filter blood and manage electrolytes.\n- Common conditions: infections, stones, cysts, tumors."
-        }
-        response["text"] = f"🧠 Based on nephrology knowledge:\n\n{disease_info[matched_term]}\n\nNeed more help? Ask me another question!"
-        return response
+    if intent == "location":
+        yield {"event": "delta", "text": "🧠 I see you're looking for nephrologists near you. Please specify your location (e.g., 'Bangalore', 'New York')."}
+
+    # Step 2: Disease-related intents get the curated answers
+    elif intent in DISEASE_INFO:
+        yield {"event": "delta", "text": f"🧠 Based on nephrology knowledge:\n\n{DISEASE_INFO[intent]}\n\nNeed more help? Ask me another question!"}
 
     # Step 3: Fallback to RAG context retrieval
-    context = retrieve_context(corrected_input)
-    answer = "\n".join([f"- {c}" for c in context])
-    response["text"] = f"🧠 Based on nephrology knowledge:\n{answer}\n\nNeed more help? Ask me another question!"
-    return response
+    else:
+        yield {"event": "delta", "text": "🧠 Based on nephrology knowledge:\n"}
+        with span("chat.retrieve"):
+            context = retrieve_context(query, query_embedding=query_embedding)
+        for i, passage in enumerate(context):
+            yield {"event": "delta", "text": f"{chr(10) if i else ''}- {passage}"}
+        yield {"event": "delta", "text": "\n\nNeed more help? Ask me another question!"}
+
+    yield {"event": "done"}
+
+def chatbot_response(user_input):
+    text = "".join(e["text"] for e in iter_chatbot_response(user_input) if e["event"] == "delta")
+    return {"text": text}
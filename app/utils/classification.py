@@ -1,7 +1,17 @@
  # app/utils/classification.py
 import torch
 import torch.nn as nn
-from torchvision import models
+from torchvision import models, transforms
+
+# Defined next to the checkpoint paths so torch-free modules can import it
+from .model_registry import CLASS_LABELS
+
+# Preprocessing used at training time
+preprocess = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
 
 class ResNetWithDropout(nn.Module):
     def __init__(self, num_classes=4):
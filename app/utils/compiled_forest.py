@@ -0,0 +1,306 @@
+# app/utils/compiled_forest.py
+"""
+Array-backed evaluator for the kidney-stone random forest.
+
+sklearn spends most of a single-row /risk-quiz request on per-call overhead
+in StandardScaler.transform and RandomForestClassifier.predict (input
+validation, one Python-level call per tree), not on the tree arithmetic.
+compile_forest() flattens every tree into one structure-of-arrays forest
+(feature, threshold, left, right, leaf probabilities) and keeps the scaler's
+mean and scale next to it. Rows are scaled and cast to float32 exactly as
+StandardScaler.transform and the sklearn trees do, so every split compares
+the same numbers; folding the scaler into the thresholds instead
+(x <= t * scale + mean) rounds differently right at a threshold.
+
+All trees advance one level per step with vectorized NumPy gathers, and
+(row, tree) pairs drop out once they reach a leaf. That beats sklearn by
+an order of magnitude for a handful of rows, but sklearn's compiled tree
+walk wins on bulk batches, so RoutedRiskPredictor sends batches above
+NEPHROSCAN_COMPILED_MAX_ROWS rows to sklearn. The server only uses the compiled forest after it has matched sklearn in the
+parity check, which runs on synthetic panels (random rows inside the quiz's
+ranges plus rows placed on and next to every split threshold) and,
+optionally, on the training data:
+
+    python -m app.utils.compiled_forest [--data "models/kindey stone urine analysis.csv"]
+
+load_risk_predictor() repeats a smaller synthetic check every time the
+server loads the approved forest.
+"""
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+
+COMPILED_PATH = "models/kidney_stone_rf_compiled.npz"
+EVAL_BLOCK_ROWS = 4096
+COMPILED_FORMAT = 2
+PARITY_ROWS = 20_000
+LOAD_PARITY_ROWS = 1024
+# Above this many rows sklearn's per-call overhead is amortized and it is faster
+COMPILED_MAX_ROWS = int(os.environ.get("NEPHROSCAN_COMPILED_MAX_ROWS", "128"))
+
+
+class CompiledForest:
+    """
+    Flat forest evaluated on raw panel values, scaled internally. Leaves
+    point to themselves (left == right == own id) with an infinite
+    threshold.
+    """
+
+    def __init__(self, feature, threshold, left, right, proba, roots, depth, classes, meta, mean, scale):
+        self.mean = mean
+        self.scale = scale
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.proba = proba
+        self.roots = roots
+        self.depth = int(depth)
+        self.classes_ = classes
+        self.meta = meta
+        self.n_features_in_ = int(meta["n_features"])
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        out = np.empty((len(X), len(self.classes_)))
+        for start in range(0, len(X), EVAL_BLOCK_ROWS):
+            out[start:start + EVAL_BLOCK_ROWS] = self._block_proba(X[start:start + EVAL_BLOCK_ROWS])
+        return out
+
+    def _block_proba(self, X):
+        # Same arithmetic as StandardScaler.transform, then the trees' float32 input
+        Z = ((X - self.mean) / self.scale).astype(np.float32).ravel()
+        n_trees = len(self.roots)
+        # One entry per (row, tree) pair, row-major; finished pairs are dropped
+        # from pos/node/offset, and their leaf is written back to `leaves`
+        leaves = np.tile(self.roots, len(X))
+        pos = np.arange(leaves.size)
+        node = leaves.copy()
+        offset = np.repeat(np.arange(len(X)) * X.shape[1], n_trees)
+        while True:
+            done = self.left[node] == node
+            if done.any():
+                leaves[pos[done]] = node[done]
+                active = ~done
+                pos, node, offset = pos[active], node[active], offset[active]
+                if not pos.size:
+                    break
+            go_left = Z[offset + self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        # Same order of operations as sklearn: sum per-tree probabilities, then average
+        return self.proba[leaves.reshape(len(X), n_trees)].sum(axis=1) / n_trees
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, path=COMPILED_PATH):
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 proba=self.proba, roots=self.roots, depth=self.depth, classes=self.classes_,
+                 mean=self.mean, scale=self.scale, meta=json.dumps(self.meta))
+
+    @classmethod
+    def load(cls, path=COMPILED_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format") != COMPILED_FORMAT:
+                raise ValueError(f"{path} was compiled in an older format; rerun python -m app.utils.compiled_forest")
+            return cls(data["feature"], data["threshold"], data["left"], data["right"], data["proba"],
+                       data["roots"], data["depth"], data["classes"], meta, data["mean"], data["scale"])
+
+
+class SklearnRiskPredictor:
+    """Reference path: scaler.transform followed by model.predict."""
+
+    def __init__(self, model, scaler):
+        self.model = model
+        self.scaler = scaler
+        self.n_features_in_ = scaler.n_features_in_
+
+    def predict(self, X):
+        return self.model.predict(self.scaler.transform(X))
+
+
+class RoutedRiskPredictor:
+    """Compiled forest for small batches, sklearn for batches above `max_rows` rows."""
+
+    def __init__(self, forest, reference, max_rows=COMPILED_MAX_ROWS):
+        self.forest = forest
+        self.reference = reference
+        self.max_rows = max_rows
+        self.n_features_in_ = forest.n_features_in_
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if len(X) > self.max_rows:
+            return self.reference.predict(X)
+        return self.forest.predict(X)
+
+
+def compile_forest(model, scaler=None):
+    """Flatten a fitted RandomForestClassifier (and optional StandardScaler) into a CompiledForest."""
+    n_features = model.n_features_in_
+    mean = np.zeros(n_features)
+    scale = np.ones(n_features)
+    if scaler is not None:
+        if getattr(scaler, "mean_", None) is not None:
+            mean = np.asarray(scaler.mean_, dtype=np.float64)
+        if getattr(scaler, "scale_", None) is not None:
+            scale = np.asarray(scaler.scale_, dtype=np.float64)
+
+    features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+    offset, depth = 0, 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        is_leaf = tree.children_left == -1
+        ids = np.arange(n, dtype=np.int32) + offset
+
+        feature = np.where(is_leaf, 0, tree.feature).astype(np.int32)
+        threshold = np.where(is_leaf, np.inf, tree.threshold)
+        left = np.where(is_leaf, ids, tree.children_left + offset).astype(np.int32)
+        right = np.where(is_leaf, ids, tree.children_right + offset).astype(np.int32)
+        # tree_.value holds class counts (or fractions); per-tree predict_proba normalizes them
+        value = tree.value[:, 0, :].astype(np.float64)
+        totals = value.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+
+        features.append(feature)
+        thresholds.append(threshold)
+        lefts.append(left)
+        rights.append(right)
+        probas.append(value / totals)
+        roots.append(offset)
+        depth = max(depth, tree.max_depth)
+        offset += n
+
+    return CompiledForest(
+        np.concatenate(features), np.concatenate(thresholds), np.concatenate(lefts), np.concatenate(rights),
+        np.concatenate(probas), np.array(roots, dtype=np.int32), depth, np.asarray(model.classes_),
+        meta={"format": COMPILED_FORMAT, "n_features": n_features, "n_trees": len(roots), "n_nodes": offset},
+        mean=mean, scale=scale,
+    )
+
+
+def load_risk_predictor(fingerprint, model_getter, scaler_getter, backend=None):
+    """
+    Compiled forest (routed to sklearn for bulk batches) for the backend
+    named in NEPHROSCAN_RISK_BACKEND ("compiled" by default) when it passed
+    the parity check for the current model and scaler files; the sklearn
+    pair otherwise.
+    """
+    backend = backend or os.environ.get("NEPHROSCAN_RISK_BACKEND", "compiled")
+    if backend == "compiled":
+        if not os.path.exists(COMPILED_PATH):
+            logging.warning(f"Compiled risk forest {COMPILED_PATH} is missing; using sklearn")
+        else:
+            try:
+                forest = CompiledForest.load(COMPILED_PATH)
+            except ValueError as e:
+                logging.warning(f"{str(e)}; using sklearn")
+                return SklearnRiskPredictor(model_getter(), scaler_getter())
+            if not forest.meta.get("approved"):
+                logging.warning("Compiled risk forest has not passed the parity check; using sklearn")
+            elif forest.meta.get("checkpoint") != fingerprint:
+                logging.warning("Compiled risk forest was built from different model files; using sklearn")
+            else:
+                model, scaler = model_getter(), scaler_getter()
+                report = evaluate_parity(forest, model, scaler, parity_panels(forest, LOAD_PARITY_ROWS))
+                if report["agreement"] < forest.meta.get("threshold", 1.0):
+                    logging.warning(f"Compiled risk forest disagrees with sklearn on synthetic panels "
+                                    f"(agreement {report['agreement']:.4f}); using sklearn")
+                    return SklearnRiskPredictor(model, scaler)
+                logging.info(f"Using compiled risk forest up to {COMPILED_MAX_ROWS} rows "
+                             f"(agreement {forest.meta['agreement']:.4f})")
+                return RoutedRiskPredictor(forest, SklearnRiskPredictor(model, scaler))
+    return SklearnRiskPredictor(model_getter(), scaler_getter())
+
+
+def read_panels(path, features):
+    """Feature matrix from a CSV with one column per feature (other columns ignored)."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        return np.array([[float(row[name]) for name in features] for row in reader], dtype=np.float64)
+
+
+def parity_panels(forest, n=PARITY_ROWS, seed=0):
+    """
+    n random panels inside the accepted ranges, plus up to n split thresholds
+    each probed at the float32 values just below, on and just above it
+    (mapped back to raw panel values). Any difference from sklearn's scaling
+    or rounding can only flip a decision right at a threshold, so those rows
+    are where a mismatch would show.
+    """
+    from .risk_model import random_panels
+
+    splits = np.flatnonzero(np.isfinite(forest.threshold))
+    picked = np.random.default_rng(seed).choice(splits, size=min(n, len(splits)), replace=False)
+    feature = np.repeat(forest.feature[picked], 3)
+    t = forest.threshold[picked].astype(np.float32)
+    scaled = np.stack([np.nextafter(t, np.float32(-np.inf)), t, np.nextafter(t, np.float32(np.inf))], axis=1).ravel()
+    edges = np.repeat(random_panels(len(picked), seed + 1), 3, axis=0)
+    edges[np.arange(len(edges)), feature] = scaled.astype(np.float64) * forest.scale[feature] + forest.mean[feature]
+    return np.vstack([random_panels(n, seed), edges])
+
+
+def evaluate_parity(forest, model, scaler, X):
+    start = time.perf_counter()
+    reference = model.predict(scaler.transform(X))
+    sklearn_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    preds = forest.predict(X)
+    compiled_seconds = time.perf_counter() - start
+    mismatches = np.flatnonzero(preds != reference)
+    return {
+        "rows": int(len(X)),
+        "agreement": float(1.0 - len(mismatches) / len(X)),
+        "mismatched_rows": mismatches[:20].tolist(),
+        "sklearn_ms": round(1000.0 * sklearn_seconds, 3),
+        "compiled_ms": round(1000.0 * compiled_seconds, 3),
+    }
+
+
+def main():
+    import joblib
+    from .model_registry import RISK_MODEL_PATH, RISK_SCALER_PATH, checkpoint_fingerprint
+    from .risk_model import FEATURES
+
+    parser = argparse.ArgumentParser(description="Compile the risk forest and check it against sklearn")
+    parser.add_argument("--data", help="Training CSV checked in addition to the synthetic panels")
+    parser.add_argument("--rows", type=int, default=PARITY_ROWS, help="Synthetic panels (and threshold probes)")
+    parser.add_argument("--threshold", type=float, default=1.0, help="Minimum prediction agreement with sklearn")
+    parser.add_argument("--model-path", default=RISK_MODEL_PATH)
+    parser.add_argument("--scaler-path", default=RISK_SCALER_PATH)
+    args = parser.parse_args()
+
+    model = joblib.load(args.model_path)
+    scaler = joblib.load(args.scaler_path)
+    forest = compile_forest(model, scaler)
+    X = parity_panels(forest, args.rows)
+    if args.data:
+        X = np.vstack([X, read_panels(args.data, FEATURES)])
+    report = evaluate_parity(forest, model, scaler, X)
+    approved = report["agreement"] >= args.threshold
+
+    status = "APPROVED" if approved else "REJECTED"
+    print(f"[{status}] compiled forest: agreement {report['agreement']:.4f} on {report['rows']} rows, "
+          f"{report['sklearn_ms']:.1f} -> {report['compiled_ms']:.1f} ms "
+          f"({forest.meta['n_trees']} trees, {forest.meta['n_nodes']} nodes, depth {forest.depth})")
+    if report["mismatched_rows"]:
+        print(f"Mismatched rows (first 20): {report['mismatched_rows']}")
+
+    forest.meta.update(report, approved=approved, threshold=args.threshold,
+                       checkpoint=checkpoint_fingerprint(args.model_path, args.scaler_path))
+    forest.save(COMPILED_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# app/utils/imaging.py
+import io
+import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .artifacts import artifact_store
+from .metrics import span
+
+PERSIST_UPLOADS = os.environ.get("NEPHROSCAN_PERSIST_UPLOADS", "1") == "1"
+UPLOAD_DIR = os.path.join("static", "uploaded")
+
+# Disk writes of the original upload happen here, off the request path
+_persist_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-persist")
+
+
+def decode_image(data):
+    """
+    Decode raw upload bytes exactly once into an (H, W, 3) uint8 RGB array.
+    Every later stage (classifier, YOLO, annotation) reads from this buffer.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return np.array(image.convert("RGB"))
+
+
+def to_classifier_tensor(image):
+    """
+    Classifier input for a decoded RGB array, through the same PIL resize,
+    ToTensor and Normalize pipeline the model was trained with
+    (classification.preprocess). fromarray copies the array, so the shared
+    buffer is never modified.
+    """
+    # classification imports torch/torchvision, which are only needed once a scan is classified
+    from .classification import preprocess
+
+    return preprocess(Image.fromarray(image))
+
+
+def to_yolo_input(image):
+    # ultralytics expects numpy input in OpenCV's BGR order
+    return np.ascontiguousarray(image[..., ::-1])
+
+
+def safe_upload_name(filename):
+    stem, ext = os.path.splitext(filename)
+    ext = ext.lower() if ext.lower() in (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff") else ".png"
+    return re.sub(r'[^a-zA-Z0-9_-]', '', stem) + ext
+
+
+@span("upload.disk_write")
+def _write_bytes(data, filename, analysis_id):
+    path = os.path.join(UPLOAD_DIR, filename)
+    try:
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        artifact_store.add(f"uploaded/{filename}", "uploaded", analysis_id, size=len(data))
+    except Exception as e:
+        logging.error(f"Failed to persist upload {path}: {str(e)}")
+
+
+def persist_upload(data, filename, analysis_id=None):
+    """
+    Save the original upload bytes in the background (no re-encode) and
+    index them in the artifact store.
+    Returns the future, or None when persistence is disabled.
+    """
+    if not PERSIST_UPLOADS:
+        return None
+    return _persist_pool.submit(_write_bytes, data, filename, analysis_id)
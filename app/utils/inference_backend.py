@@ -0,0 +1,284 @@
+# app/utils/inference_backend.py
+"""
+Optimized CPU inference backends for ResNetWithDropout.
+
+Backends:
+    eager          plain nn.Module in fp32 (reference)
+    torchscript    traced + frozen graph, batch norm folded into conv weights
+    channels_last  frozen graph running in NHWC memory layout
+    int8_dynamic   dynamic int8 quantization of the Linear layers
+    int8_static    FX static int8 quantization calibrated on real scans
+
+A non-eager backend is only used by the server after it has passed the
+parity check below, which writes the compiled model and an approval record:
+
+    python -m app.utils.inference_backend --images held_out/ --calibration calib/ --backend int8_static
+
+int8_static is calibrated on --calibration, which must not share images
+with --images: scoring the parity check on the calibration scans would
+overstate its agreement.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+
+import torch
+import torch.nn as nn
+
+from .classification import load_classifier
+from .model_registry import APPROVAL_PATH
+
+BACKENDS = ["eager", "torchscript", "channels_last", "int8_dynamic", "int8_static"]
+COMPILED_TEMPLATE = "models/classifier_{backend}.pt"
+DEFAULT_THRESHOLD = 0.99
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class _ChannelsLast(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def _freeze(model, example):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        # freeze() inlines parameters and folds conv + batch norm
+        frozen = torch.jit.freeze(traced)
+        return torch.jit.optimize_for_inference(frozen)
+
+
+def _quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    return engines[0]
+
+
+def build_backend(model, backend, calibration_batches=None):
+    """Return a model for `backend` built from an eval-mode eager model."""
+    example = torch.zeros(1, 3, 224, 224)
+    model.eval()
+
+    if backend == "eager":
+        return model
+    if backend == "torchscript":
+        return _freeze(model, example)
+    if backend == "channels_last":
+        return _freeze(_ChannelsLast(model).eval(), example)
+    if backend == "int8_dynamic":
+        quantized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            return torch.jit.trace(quantized, example)
+    if backend == "int8_static":
+        if not calibration_batches:
+            raise ValueError("int8_static needs calibration images")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        engine = _quantized_engine()
+        torch.backends.quantized.engine = engine
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (example,))
+        with torch.no_grad():
+            for batch in calibration_batches:
+                prepared(batch)
+        quantized = convert_fx(prepared)
+        with torch.no_grad():
+            return torch.jit.freeze(torch.jit.trace(quantized, example))
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+
+def load_approval(path=APPROVAL_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def select_backend(fingerprint, backend=None):
+    """
+    Return (backend, compiled_path, reason): the backend named in
+    NEPHROSCAN_CLASSIFIER_BACKEND if it is approved for this checkpoint and
+    its compiled model exists, else ("eager", None, why it was not used).
+    """
+    backend = backend or os.environ.get("NEPHROSCAN_CLASSIFIER_BACKEND", "eager")
+    if backend == "eager":
+        return "eager", None, None
+    record = load_approval().get(backend)
+    compiled_path = COMPILED_TEMPLATE.format(backend=backend)
+    if not record or not record.get("approved"):
+        return "eager", None, f"Classifier backend '{backend}' has not passed the parity check; using eager"
+    if backend == "int8_static" and not record.get("calibration_images"):
+        # Older approvals were scored on their own calibration scans
+        return "eager", None, ("Classifier backend 'int8_static' was approved without a separate calibration set; "
+                               "rerun the parity check with --calibration; using eager")
+    if record.get("checkpoint") != fingerprint:
+        return "eager", None, f"Classifier backend '{backend}' was approved for a different checkpoint; using eager"
+    if not os.path.exists(compiled_path):
+        return "eager", None, f"Compiled classifier {compiled_path} is missing; using eager"
+    return backend, compiled_path, None
+
+
+def load_inference_classifier(model_path, fingerprint, backend=None):
+    """
+    Load the classifier for the backend named in NEPHROSCAN_CLASSIFIER_BACKEND.
+    Falls back to eager when the backend has no approval for this checkpoint.
+    The returned model carries the backend and compiled_path it was loaded with.
+    """
+    backend, compiled_path, reason = select_backend(fingerprint, backend)
+    if reason:
+        logging.warning(reason)
+    if compiled_path is not None:
+        if backend.startswith("int8"):
+            torch.backends.quantized.engine = load_approval()[backend].get("engine", _quantized_engine())
+        model = torch.jit.load(compiled_path, map_location="cpu")
+        model.eval()
+        logging.info(f"Using classifier backend '{backend}' (agreement {load_approval()[backend]['agreement']:.4f})")
+    else:
+        model = load_classifier(model_path)
+    model.backend = backend
+    model.compiled_path = compiled_path
+    return model
+
+
+def _iter_image_paths(folder):
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def _load_batches(folder, batch_size=32):
+    from .imaging import decode_image, to_classifier_tensor
+
+    batch = []
+    batches = []
+    for path in _iter_image_paths(folder):
+        with open(path, "rb") as f:
+            batch.append(to_classifier_tensor(decode_image(f.read())))
+        if len(batch) == batch_size:
+            batches.append(torch.stack(batch))
+            batch = []
+    if batch:
+        batches.append(torch.stack(batch))
+    return batches
+
+
+def _shared_images(image_dir, calibration_dir):
+    """Parity images whose contents also appear in the calibration folder."""
+    def digests(folder):
+        found = {}
+        for path in _iter_image_paths(folder):
+            with open(path, "rb") as f:
+                found[hashlib.sha256(f.read()).hexdigest()] = os.path.realpath(path)
+        return found
+
+    parity, calibration = digests(image_dir), digests(calibration_dir)
+    return sorted(parity[d] for d in parity.keys() & calibration.keys())
+
+
+def _predict(model, batches):
+    preds = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            preds.append(torch.argmax(model(batch), dim=1))
+    return torch.cat(preds), time.perf_counter() - start
+
+
+def evaluate_parity(image_dir, backends, model_path, threshold=DEFAULT_THRESHOLD, calibration_dir=None):
+    """
+    Compare each backend's predictions against the eager model on a held-out
+    folder. Returns {backend: report}; a backend is approved only if its
+    top-1 agreement with eager is at least `threshold`. int8_static is
+    calibrated on `calibration_dir`, which must not overlap `image_dir`.
+    """
+    batches = _load_batches(image_dir)
+    if not batches:
+        raise ValueError(f"No images found in {image_dir}")
+    calibration = None
+    if "int8_static" in backends:
+        if not calibration_dir:
+            raise ValueError("int8_static needs a calibration folder separate from the parity images")
+        overlap = _shared_images(image_dir, calibration_dir)
+        if overlap:
+            raise ValueError(f"{len(overlap)} calibration image(s) are also parity images, e.g. {overlap[0]}")
+        calibration = _load_batches(calibration_dir)
+
+    eager = load_classifier(model_path)
+    reference, eager_seconds = _predict(eager, batches)
+    n = int(reference.numel())
+
+    reports = {}
+    for backend in backends:
+        if backend == "eager":
+            continue
+        model = build_backend(load_classifier(model_path), backend, calibration)
+        _predict(model, batches[:1])  # warm-up
+        preds, seconds = _predict(model, batches)
+        agreement = (preds == reference).float().mean().item()
+        reports[backend] = {
+            "model": model,
+            "images": n,
+            "agreement": agreement,
+            "approved": agreement >= threshold,
+            "threshold": threshold,
+            "eager_ms_per_image": 1000.0 * eager_seconds / n,
+            "backend_ms_per_image": 1000.0 * seconds / n,
+        }
+        if backend == "int8_static":
+            reports[backend]["calibration_images"] = sum(len(batch) for batch in calibration)
+    return reports
+
+
+def main():
+    from .model_registry import CLASSIFIER_PATH, checkpoint_fingerprint
+
+    parser = argparse.ArgumentParser(description="Check and enable an optimized classifier backend")
+    parser.add_argument("--images", required=True, help="Held-out image folder used for the parity check")
+    parser.add_argument("--backend", action="append", choices=BACKENDS[1:], help="Backend(s) to check (default: all)")
+    parser.add_argument("--calibration", help="Image folder for int8_static calibration, disjoint from --images "
+                                              "(required for int8_static)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Minimum top-1 agreement with eager")
+    parser.add_argument("--model-path", default=CLASSIFIER_PATH)
+    args = parser.parse_args()
+
+    backends = args.backend or BACKENDS[1:]
+    if "int8_static" in backends and not args.calibration:
+        if args.backend:
+            parser.error("--backend int8_static requires --calibration")
+        print("Skipping int8_static: it needs --calibration")
+        backends = [b for b in backends if b != "int8_static"]
+    try:
+        reports = evaluate_parity(args.images, backends, args.model_path, args.threshold, args.calibration)
+    except ValueError as e:
+        parser.error(str(e))
+    approval = load_approval()
+    fingerprint = checkpoint_fingerprint(args.model_path)
+
+    for backend, report in reports.items():
+        model = report.pop("model")
+        status = "APPROVED" if report["approved"] else "REJECTED"
+        print(f"[{status}] {backend}: agreement {report['agreement']:.4f} on {report['images']} images, "
+              f"{report['eager_ms_per_image']:.2f} -> {report['backend_ms_per_image']:.2f} ms/image")
+        if report["approved"]:
+            torch.jit.save(model, COMPILED_TEMPLATE.format(backend=backend))
+            if backend.startswith("int8"):
+                report["engine"] = torch.backends.quantized.engine
+        report["checkpoint"] = fingerprint
+        approval[backend] = report
+
+    with open(APPROVAL_PATH, "w", encoding="utf-8") as f:
+        json.dump(approval, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# app/utils/intent_router.py
+import os
+
+import numpy as np
+
+INTENT_THRESHOLD = float(os.environ.get("NEPHROSCAN_INTENT_THRESHOLD", "0.55"))
+
+# A few example phrasings per intent; their embeddings are the prototypes.
+# "general" soaks up questions that should go to retrieval.
+INTENT_PROTOTYPES = {
+    "location": [
+        "find a nephrologist near me",
+        "kidney specialist in my city",
+        "which hospital near my location treats kidney problems",
+        "where can I see a kidney doctor in my area",
+        "nephrologists in my town",
+    ],
+    "cyst": [
+        "what is a kidney cyst",
+        "is a renal cyst dangerous",
+        "how is a kidney cyst treated",
+        "I have a cyst on my kidney",
+    ],
+    "stone": [
+        "what is a kidney stone",
+        "how are kidney stones treated",
+        "I have a kidney stone",
+        "what causes renal calculi",
+    ],
+    "tumor": [
+        "what is a kidney tumor",
+        "is a renal tumor serious",
+        "how is a kidney tumor treated",
+        "I have a tumor in my kidney",
+    ],
+    "cancer": [
+        "what is kidney cancer",
+        "renal cell carcinoma treatment",
+        "is kidney cancer curable",
+    ],
+    "kidney": [
+        "what does the kidney do",
+        "what is the function of the kidneys",
+        "how do kidneys work",
+    ],
+    "general": [
+        "what foods should I avoid",
+        "how much water should I drink every day",
+        "are there ayurvedic or herbal remedies",
+        "what are the symptoms and when should I see a doctor",
+        "what tests are used for diagnosis",
+        "what lifestyle changes help prevent recurrence",
+        "hello",
+    ],
+}
+
+
+class IntentRouter:
+    """
+    Classifies a message by cosine similarity between its embedding and the
+    prototype embeddings of each intent, in one matrix-vector product. The
+    same query embedding is then reused for retrieval.
+    """
+
+    def __init__(self, embedder, prototypes=INTENT_PROTOTYPES, threshold=INTENT_THRESHOLD):
+        self.threshold = threshold
+        self.intents = list(prototypes)
+        phrases = [p for intent in self.intents for p in prototypes[intent]]
+        self._owner = np.array([i for i, intent in enumerate(self.intents) for _ in prototypes[intent]])
+        matrix = np.asarray(embedder.encode(phrases), dtype=np.float32)
+        self._matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    def scores(self, query_embedding):
+        v = np.asarray(query_embedding, dtype=np.float32).ravel()
+        sims = self._matrix @ (v / (np.linalg.norm(v) or 1.0))
+        best = np.full(len(self.intents), -1.0, dtype=np.float32)
+        np.maximum.at(best, self._owner, sims)
+        return dict(zip(self.intents, best.tolist()))
+
+    def route(self, query_embedding):
+        """Return (intent, score); "general" when nothing clears the threshold."""
+        scores = self.scores(query_embedding)
+        intent = max(scores, key=scores.get)
+        if intent != "general" and scores[intent] < self.threshold:
+            intent = "general"
+        return intent, scores[intent]
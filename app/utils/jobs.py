@@ -0,0 +1,307 @@
+# app/utils/jobs.py
+"""
+Analysis results and background jobs, kept in one SQLite file that every
+gunicorn worker opens, so a follow-up request (results page, PDF, job
+status or event stream) can land on any worker.
+
+Jobs run on a thread pool inside the worker that accepted them; their
+status, result and progress events are written to the shared database as
+they happen, and readers in any worker poll it.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import logging
+
+JOB_WORKERS = int(os.environ.get("NEPHROSCAN_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("NEPHROSCAN_JOB_QUEUE_SIZE", "32"))
+RESULT_TTL_SECONDS = int(os.environ.get("NEPHROSCAN_RESULT_TTL_SECONDS", "3600"))
+RESULT_MAX_ENTRIES = int(os.environ.get("NEPHROSCAN_RESULT_MAX_ENTRIES", "1000"))
+STATE_DB = os.environ.get("NEPHROSCAN_STATE_DB", os.path.join("cache", "state.sqlite3"))
+# How often event streams look for progress written by another worker
+EVENT_POLL_SECONDS = 0.25
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results (id TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_created ON results (created)",
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT NOT NULL,"
+    " result TEXT, error TEXT, created REAL NOT NULL, finished REAL)",
+    "CREATE INDEX IF NOT EXISTS jobs_kind_created ON jobs (kind, created)",
+    "CREATE TABLE IF NOT EXISTS job_events ("
+    " job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (job_id, seq))",
+)
+
+# Wakes event streams in this process as soon as a local job makes progress
+_progress = threading.Condition()
+
+
+class StateDB:
+    """
+    One SQLite connection per process to the shared state file. The
+    connection is opened lazily and a new one is opened after a fork, so a
+    preloading gunicorn master never shares its connection with the workers.
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self._conn = None
+        self._inherited = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None or self._pid != os.getpid():
+            # Closing a connection inherited across fork() can disturb the
+            # parent's WAL, so it is kept referenced and never used
+            self._inherited = self._conn
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            self._pid = os.getpid()
+        return self._conn
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._db().execute(sql, params).fetchall()
+
+    def execute(self, *statements):
+        """Run (sql, params) pairs in one transaction."""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    db.execute(sql, params)
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+
+class ResultStore:
+    """
+    Server-side store for analysis results, so the cookie session only needs
+    to carry an analysis id. Entries expire after `ttl` seconds and the
+    oldest are dropped beyond `max_entries`.
+    """
+
+    def __init__(self, db, ttl=RESULT_TTL_SECONDS, max_entries=RESULT_MAX_ENTRIES):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def put(self, value, key=None):
+        key = key or uuid.uuid4().hex
+        now = time.time()
+        self.db.execute(
+            ("INSERT OR REPLACE INTO results (id, created, value) VALUES (?, ?, ?)", (key, now, json.dumps(value))),
+            ("DELETE FROM results WHERE created < ?", (now - self.ttl,)),
+            ("DELETE FROM results WHERE id IN (SELECT id FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+             (self.max_entries,)),
+        )
+        return key
+
+    def get(self, key):
+        if not key:
+            return None
+        rows = self.db.query("SELECT value FROM results WHERE id = ? AND created >= ?",
+                             (key, time.time() - self.ttl))
+        return json.loads(rows[0][0]) if rows else None
+
+    def __len__(self):
+        return self.db.query("SELECT COUNT(*) FROM results")[0][0]
+
+
+class Job:
+    """Snapshot of a job's row; iter_events() follows it as it progresses."""
+
+    def __init__(self, db, job_id, status="queued", stage="queued", result=None, error=None,
+                 created=None, finished=None):
+        self.db = db
+        self.id = job_id
+        self.status = status
+        self.stage = stage
+        self.result = result
+        self.error = error
+        self.created = created or time.time()
+        self.finished = finished
+        self._seq = 0
+
+    def _emit(self, stage, **extra):
+        # Only called from the worker thread running the job
+        self.stage = stage
+        self._seq += 1
+        event = dict(extra, stage=stage, status=self.status, time=time.time())
+        self.db.execute(
+            ("UPDATE jobs SET status = ?, stage = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+             (self.status, stage, json.dumps(self.result), self.error, self.finished, self.id)),
+            ("INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)", (self.id, self._seq, json.dumps(event))),
+        )
+        with _progress:
+            _progress.notify_all()
+
+    def progress(self, stage):
+        self._emit(stage)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def iter_events(self, after=0, timeout=15.0, max_seconds=None):
+        """
+        Yield progress events after sequence number `after` as they happen,
+        ending after done/failed or once `max_seconds` have passed. Each
+        event carries its sequence number as "id".
+        """
+        sent = after
+        started = idle_since = time.time()
+        while max_seconds is None or time.time() - started < max_seconds:
+            rows = self.db.query("SELECT seq, event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                 (self.id, sent))
+            if not rows:
+                if time.time() - idle_since >= timeout:
+                    idle_since = time.time()
+                    yield None  # keep-alive
+                with _progress:
+                    _progress.wait(EVENT_POLL_SECONDS)
+                continue
+            idle_since = time.time()
+            for seq, data in rows:
+                sent = seq
+                event = dict(json.loads(data), id=seq)
+                yield event
+                if event["status"] in ("done", "failed"):
+                    return
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs of one `kind`, served by a fixed worker pool in
+    this process. submit() raises QueueFull instead of blocking, so callers
+    can apply backpressure (HTTP 429). get() finds jobs submitted in any
+    worker.
+    """
+
+    def __init__(self, db, kind="analysis", workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE, ttl=RESULT_TTL_SECONDS):
+        self.db = db
+        self.kind = kind
+        self.workers = workers
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.counters = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(self.workers - len(self._threads)):
+                t = threading.Thread(target=self._run, name=f"{self.kind}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, fn, *args):
+        """fn is called as fn(*args, progress=callback) on a worker thread."""
+        self._ensure_started()
+        job = Job(self.db, uuid.uuid4().hex)
+        job._seq = 1
+        queued = {"stage": job.stage, "status": job.status, "time": job.created}
+        self._evict()
+        # Row and first event exist before a worker can pick the job up
+        self.db.execute(
+            ("INSERT INTO jobs (id, kind, status, stage, created) VALUES (?, ?, ?, ?, ?)",
+             (job.id, self.kind, job.status, job.stage, job.created)),
+            ("INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)", (job.id, 1, json.dumps(queued))),
+        )
+        try:
+            self._queue.put_nowait((job, fn, args))
+        except queue.Full:
+            self.db.execute(("DELETE FROM job_events WHERE job_id = ?", (job.id,)),
+                            ("DELETE FROM jobs WHERE id = ?", (job.id,)))
+            with self._lock:
+                self.counters["rejected"] += 1
+            raise QueueFull()
+        with self._lock:
+            self.counters["submitted"] += 1
+        return job
+
+    def get(self, job_id):
+        rows = self.db.query(
+            "SELECT status, stage, result, error, created, finished FROM jobs WHERE id = ? AND kind = ?",
+            (job_id, self.kind))
+        if not rows:
+            return None
+        status, stage, result, error, created, finished = rows[0]
+        return Job(self.db, job_id, status, stage, json.loads(result) if result else None, error, created, finished)
+
+    def _evict(self):
+        # Also drops jobs left unfinished by a worker that died
+        cutoff = time.time() - self.ttl
+        self.db.execute(
+            ("DELETE FROM job_events WHERE job_id IN"
+             " (SELECT id FROM jobs WHERE kind = ? AND COALESCE(finished, created) < ?)", (self.kind, cutoff)),
+            ("DELETE FROM jobs WHERE kind = ? AND COALESCE(finished, created) < ?", (self.kind, cutoff)),
+        )
+
+    def _run(self):
+        while True:
+            job, fn, args = self._queue.get()
+            job.status = "running"
+            try:
+                job.result = fn(*args, progress=job.progress)
+                job.status = "done"
+            except Exception as e:
+                logging.error(f"{self.kind.capitalize()} job {job.id} failed: {str(e)}")
+                job.error = "Processing failed."
+                job.status = "failed"
+            job.finished = time.time()
+            with self._lock:
+                self.counters[job.status] += 1
+            try:
+                job._emit(job.status)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to record {self.kind} job {job.id}: {str(e)}")
+            self._queue.task_done()
+
+    def stats(self):
+        """Counters and queue depth are this worker's; tracked_jobs covers all workers."""
+        tracked = self.db.query("SELECT COUNT(*) FROM jobs WHERE kind = ?", (self.kind,))[0][0]
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update({
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "workers": self.workers,
+                "tracked_jobs": tracked,
+            })
+            return stats
+
+
+def sse_format(event, name_key="stage"):
+    if event is None:
+        return ": keep-alive\n\n"
+    # An id lets EventSource resume with Last-Event-ID after a reconnect
+    event_id = f"id: {event['id']}\n" if "id" in event else ""
+    return f"{event_id}event: {event[name_key]}\ndata: {json.dumps(event)}\n\n"
+
+
+state_db = StateDB()
+result_store = ResultStore(state_db)
+job_queue = JobQueue(state_db)
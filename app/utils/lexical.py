@@ -0,0 +1,153 @@
+# app/utils/lexical.py
+import os
+import re
+import math
+import pickle
+import threading
+
+import numpy as np
+
+# A lexical answer is returned without running the embedder only when the
+# best passage covers most query terms and clearly beats the runner-up
+LEXICAL_MIN_COVERAGE = float(os.environ.get("NEPHROSCAN_LEXICAL_MIN_COVERAGE", "0.75"))
+LEXICAL_MIN_MARGIN = float(os.environ.get("NEPHROSCAN_LEXICAL_MIN_MARGIN", "0.25"))
+RRF_K = 60
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does did for from has have how i if in into is it its
+me my of on or our should so that the their them then there these they this to was we what when
+where which who why will with would you your about tell explain please
+""".split())
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        # Cheap plural folding so "stones" matches "stone"
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring over the RAG chunks."""
+
+    def __init__(self, postings, doc_lengths, k1=1.5, b=0.75):
+        # postings: term -> (int32 doc ids, float32 term frequencies)
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        n = len(doc_lengths)
+        self.avgdl = float(doc_lengths.mean()) if n else 0.0
+        self.idf = {t: math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)) for t, (ids, _) in postings.items()}
+
+    @classmethod
+    def build(cls, texts):
+        postings = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, c in counts.items():
+                postings.setdefault(t, ([], []))
+                postings[t][0].append(doc_id)
+                postings[t][1].append(c)
+        postings = {t: (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.float32))
+                    for t, (ids, tfs) in postings.items()}
+        return cls(postings, doc_lengths)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({"postings": self.postings, "doc_lengths": self.doc_lengths,
+                         "k1": self.k1, "b": self.b}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["postings"], data["doc_lengths"], data["k1"], data["b"])
+
+    def search(self, query, top_k=3):
+        """
+        Returns (hits, coverage, margin): hits is [(doc_id, score)] best first,
+        coverage the share of query terms found in the best hit, margin the
+        relative lead of the best score over the runner-up.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not len(self.doc_lengths):
+            return [], 0.0, 0.0
+
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.avgdl, 1e-9))
+        matched = []
+        for t in terms:
+            posting = self.postings.get(t)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            scores[ids] += self.idf[t] * tfs * (self.k1 + 1) / (tfs + norm[ids])
+            matched.append(t)
+        if not matched:
+            return [], 0.0, 0.0
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+        if not hits:
+            return [], 0.0, 0.0
+
+        best = hits[0][0]
+        covered = sum(1 for t in matched if np.any(self.postings[t][0] == best))
+        runner_up = float(np.partition(scores, -2)[-2]) if len(scores) > 1 else 0.0
+        margin = (hits[0][1] - runner_up) / hits[0][1]
+        return hits, covered / len(terms), margin
+
+    def is_confident(self, coverage, margin):
+        return coverage >= LEXICAL_MIN_COVERAGE and margin >= LEXICAL_MIN_MARGIN
+
+
+def reciprocal_rank_fusion(rankings, top_k, k=RRF_K):
+    """Fuse several best-first lists of doc ids."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda kv: -kv[1])[:top_k]]
+
+
+class PathStats:
+    """Hit counts and latency per retrieval path (lexical / fused / dense)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+
+    def record(self, path, seconds):
+        with self._lock:
+            s = self._paths.setdefault(path, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            ms = seconds * 1000.0
+            s["count"] += 1
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+
+    def stats(self):
+        with self._lock:
+            total = sum(s["count"] for s in self._paths.values())
+            return {
+                path: {
+                    "count": s["count"],
+                    "share": round(s["count"] / total, 4) if total else 0.0,
+                    "mean_ms": round(s["total_ms"] / s["count"], 3),
+                    "max_ms": round(s["max_ms"], 3),
+                }
+                for path, s in self._paths.items()
+            }
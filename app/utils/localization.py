@@ -1,28 +1,49 @@
 import os
 from PIL import Image, ImageDraw, ImageFont
-from ultralytics import YOLO
+import numpy as np
+from .model_registry import registry
+from .imaging import to_yolo_input
 
-def localize_kidney(image_path):
-    model = YOLO("models/yolov8_localizer.pt")
-    results = model(image_path, conf=0.15)
-
-    image = Image.open(image_path).convert("RGB")
-    draw = ImageDraw.Draw(image)
+def localize_kidney(image, model=None, annotate=True):
+    """
+    image: either a path or an (H, W, 3) uint8 RGB array decoded once by the
+    caller (see imaging.decode_image). Returns (boxes, annotated PIL image);
+    the image is None when annotate=False (boxes are drawn client-side).
+    """
+    # Borrow the resident YOLO instance instead of reloading the checkpoint
+    if model is None:
+        model = registry.get("localizer")
 
+    source = to_yolo_input(image) if isinstance(image, np.ndarray) else image
     boxes = []
 
-    if results and results[0].boxes is not None and results[0].boxes.xyxy is not None:
-        xyxy = results[0].boxes.xyxy.cpu().numpy()
-        confs = results[0].boxes.conf.cpu().numpy()
-
-        for coords in xyxy:
-            coords = coords.tolist()
-            boxes.append(coords)
+    # The results live on the shared predictor, so read the boxes out before
+    # another thread can run the next prediction
+    with registry.inference_lock("localizer"):
+        if isinstance(image, np.ndarray):
+            results = model(source, conf=0.15, verbose=False)
+        else:
+            results = model(source, conf=0.15)
+        if results and results[0].boxes is not None and results[0].boxes.xyxy is not None:
+            xyxy = results[0].boxes.xyxy.cpu().numpy()
+            boxes = [coords.tolist() for coords in xyxy]
 
-            # Draw rectangle only (remove label)
-            draw.rectangle(coords, outline="red", width=3)
+    if not annotate:
+        return boxes, None
+    if not isinstance(image, np.ndarray):
+        image = Image.open(image).convert("RGB")
+    return boxes, draw_boxes(image, boxes)
 
-    return boxes, image
+def draw_boxes(image, boxes):
+    """Burn rectangles for boxes into a PIL image (or RGB array) and return the PIL image."""
+    if isinstance(image, np.ndarray):
+        # fromarray copies RGB data, so drawing never touches the shared buffer
+        image = Image.fromarray(image)
+    draw = ImageDraw.Draw(image)
+    for coords in boxes:
+        # Draw rectangle only (remove label)
+        draw.rectangle(coords, outline="red", width=3)
+    return image
 
 def map_coordinates_to_regions(boxes, image_width=512, image_height=512):
     """
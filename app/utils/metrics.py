@@ -0,0 +1,295 @@
+# app/utils/metrics.py
+"""
+Request and stage latency metrics in the Prometheus text format.
+
+    with span("upload.classify"):
+        ...
+
+records the block's duration in the nephroscan_stage_seconds histogram and
+in the current request's trace. init_app() times every request. Requests
+slower than NEPHROSCAN_SLOW_REQUEST_MS are logged with their stage
+breakdown. If NEPHROSCAN_PROFILE_SLOW_MS is set, a sampling profiler walks
+the request thread's stack every NEPHROSCAN_PROFILE_INTERVAL_MS and writes
+flamegraph-ready folded stacks (flamegraph.pl / speedscope) to
+cache/profiles/ for requests slower than that threshold.
+
+record_startup() logs and exports how long a process took to become ready
+and its memory footprint (RSS, and PSS/shared where /proc allows it, which
+is what matters for pre-forked workers sharing the master's pages).
+"""
+import os
+import sys
+import time
+import resource
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOW_REQUEST_MS = float(os.environ.get("NEPHROSCAN_SLOW_REQUEST_MS", "2000"))
+PROFILE_SLOW_MS = float(os.environ.get("NEPHROSCAN_PROFILE_SLOW_MS", "0"))  # 0 disables the profiler
+PROFILE_INTERVAL_MS = float(os.environ.get("NEPHROSCAN_PROFILE_INTERVAL_MS", "10"))
+PROFILE_DIR = os.environ.get("NEPHROSCAN_PROFILE_DIR", os.path.join("cache", "profiles"))
+
+_IMPORTED = time.perf_counter()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.labelnames + ("le",), key + (repr(bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from `fn`, which returns a number or {label value: number}."""
+
+    def __init__(self, name, help, fn, labelname=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelname = labelname
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.error(f"Gauge {self.name} failed: {str(e)}")
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                if v is not None:
+                    lines.append(f"{self.name}{_format_labels((self.labelname,), (label,))} {float(v)}")
+        elif value is not None:
+            lines.append(f"{self.name} {float(value)}")
+        return lines
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of registered request threads from one background
+    thread. Stacks are only kept while a request is in flight and written
+    out only when it turns out to be slow.
+    """
+
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, out_dir=PROFILE_DIR):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.out_dir = out_dir
+        self._active = {}  # thread ident -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dumps = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self, ident):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._active[ident] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, ident, seconds, name):
+        if not self.enabled:
+            return None
+        with self._lock:
+            stacks = self._active.pop(ident, None)
+        if not stacks or seconds < self.threshold:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{name}_{int(seconds * 1000)}ms.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumps += 1
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def process_uptime():
+    """Seconds since this process started (or forked); since this module's import where /proc is missing."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _IMPORTED
+
+
+def process_memory():
+    """
+    Bytes of resident memory: rss, plus pss (shared pages split between the
+    processes mapping them) and shared on Linux. Elsewhere only the peak RSS
+    is available.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared"}
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    usage[fields[key]] = usage.get(fields[key], 0) + int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage = {"rss": rss if sys.platform == "darwin" else rss * 1024}
+    return usage
+
+
+class Metrics:
+    def __init__(self):
+        self._collectors = []
+        self._local = threading.local()
+        self.startup_seconds = {}  # role -> seconds from process start (or fork) to ready
+        self.profiler = SlowRequestProfiler()
+        self.stage_seconds = self.histogram(
+            "nephroscan_stage_seconds", "Duration of each processing stage", ("stage",))
+        self.request_seconds = self.histogram(
+            "nephroscan_request_seconds", "HTTP request duration until the response is returned",
+            ("endpoint", "method", "status"))
+        self.gauge("nephroscan_startup_seconds", "Time from process start (or fork) until ready to serve",
+                   lambda: dict(self.startup_seconds), "role")
+        self.gauge("nephroscan_process_memory_bytes", "Resident memory of this process",
+                   process_memory, "kind")
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, help, labelnames, buckets)
+        self._collectors.append(histogram)
+        return histogram
+
+    def gauge(self, name, help, fn, labelname=None):
+        gauge = Gauge(name, help, fn, labelname)
+        self._collectors.append(gauge)
+        return gauge
+
+    def render(self):
+        lines = []
+        for collector in self._collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+    def current_trace(self):
+        return getattr(self._local, "trace", None)
+
+    def record_stage(self, stage, seconds):
+        self.stage_seconds.observe(seconds, stage=stage)
+        trace = self.current_trace()
+        if trace is not None:
+            trace["stages"].append((stage, seconds))
+
+    def record_startup(self, role="app"):
+        """Log and export the cold start time and memory of this process once it is ready."""
+        seconds = self.startup_seconds[role] = process_uptime()
+        memory = ", ".join(f"{kind} {size / (1024 * 1024):.1f} MB" for kind, size in process_memory().items())
+        logging.info(f"Startup ({role}, pid {os.getpid()}): ready in {seconds:.2f}s; {memory}")
+        return seconds
+
+    def init_app(self, app):
+        from flask import request
+
+        @app.before_request
+        def _start_trace():
+            self._local.trace = {"start": time.perf_counter(), "stages": [], "status": 500}
+            self.profiler.start(threading.get_ident())
+
+        @app.after_request
+        def _record_status(response):
+            trace = self.current_trace()
+            if trace is not None:
+                trace["status"] = response.status_code
+            return response
+
+        @app.teardown_request
+        def _finish_trace(exc):
+            trace = self.current_trace()
+            if trace is None:
+                return
+            self._local.trace = None
+            seconds = time.perf_counter() - trace["start"]
+            endpoint = request.endpoint or "unmatched"
+            self.request_seconds.observe(seconds, endpoint=endpoint, method=request.method, status=trace["status"])
+            profile = self.profiler.stop(threading.get_ident(), seconds, endpoint.replace(".", "_"))
+            if seconds * 1000.0 >= SLOW_REQUEST_MS:
+                breakdown = ", ".join(f"{stage}={s * 1000:.1f}ms" for stage, s in trace["stages"])
+                logging.warning(f"Slow request {request.method} {request.path}: {seconds * 1000:.1f}ms "
+                                f"[{breakdown}]" + (f", profile written to {profile}" if profile else ""))
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block (or decorated function) as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_stage(stage, time.perf_counter() - start)
+
+
+metrics = Metrics()
@@ -0,0 +1,106 @@
+# app/utils/microbatch.py
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching of calls made from many threads. Callers submit
+    one item at a time; a background thread gathers items for up to
+    `window_ms` or `max_batch_size` items, calls process(items) once and
+    resolves each caller's future with the matching element of the returned
+    sequence. Subclasses implement process().
+    """
+
+    name = "micro-batcher"
+
+    def __init__(self, window_ms, max_batch_size):
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+        self._max_queue_depth = 0
+        self._size_histogram = {}
+
+    def process(self, items):
+        raise NotImplementedError
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return future
+
+    def _collect(self):
+        # Block for the first request, then keep gathering until the window
+        # closes or the batch is full
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Drop requests whose caller already cancelled; the rest can no
+            # longer be cancelled, so resolving them below cannot raise
+            batch = [(item, f) for item, f in self._collect() if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            futures = [f for _, f in batch]
+            try:
+                results = self.process([item for item, _ in batch])
+            except Exception as e:
+                logging.error(f"{self.name} batch failed: {str(e)}")
+                for f in futures:
+                    f.set_exception(e)
+                continue
+
+            for f, result in zip(futures, results):
+                f.set_result(result)
+
+            with self._stats_lock:
+                size = len(batch)
+                self._batches += 1
+                self._items += size
+                self._max_seen = max(self._max_seen, size)
+                self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": round(self._items / self._batches, 3) if self._batches else 0.0,
+                "max_batch_size_seen": self._max_seen,
+                "batch_size_histogram": dict(sorted(self._size_histogram.items())),
+                "window_ms": self.window * 1000.0,
+                "max_batch_size": self.max_batch_size,
+            }
@@ -0,0 +1,286 @@
+# app/utils/model_registry.py
+import os
+import threading
+import contextlib
+import time
+import hashlib
+import logging
+
+import numpy as np
+
+from .compiled_forest import load_risk_predictor
+from .spelling import load_spell_checker
+from .rag_store import load_index, load_chunks, load_lexical_index
+from .intent_router import IntentRouter
+
+CLASSIFIER_PATH = "models/ResNet18_Optimized_AntiOverfit.pth"
+LOCALIZER_PATH = "models/yolov8_localizer.pt"
+RISK_MODEL_PATH = "models/kidney_stone_rf_model.joblib"
+RISK_SCALER_PATH = "models/kidney_stone_scaler.joblib"
+# Written by the inference_backend parity check (kept here so importing it needs no torch)
+APPROVAL_PATH = "models/inference_backend.json"
+EMBEDDER_NAME = "all-MiniLM-L6-v2"
+CLASS_LABELS = ["cyst", "normal", "stone", "tumor"]
+
+
+def checkpoint_fingerprint(*paths):
+    """Short hash that changes whenever any of the given files is replaced or rewritten."""
+    h = hashlib.sha256()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+        except OSError:
+            h.update(f"{path}:missing".encode())
+    return h.hexdigest()[:16]
+
+
+class ModelRegistry:
+    """
+    Owns every model artifact used by the app. Each artifact is loaded at most
+    once per process, warmed up with a dummy inference, and then handed out to
+    callers via get(name).
+
+    "Loaded" and "ready" are reported separately: a model is ready when a
+    request that needs it can be served, i.e. it is loaded or will load on
+    first use because its last load attempt (if any, including load_all())
+    did not fail.
+
+    A model registered with a `version` callable also records version(model)
+    when it is loaded, so callers can tell which artifacts are in use without
+    looking at the files again.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._warmups = {}
+        self._models = {}
+        self._load_times = {}
+        self._errors = {}
+        self._version_fns = {}
+        self._versions = {}
+        self._locks = {}
+        self._inference_locks = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None, thread_safe=True, version=None):
+        """thread_safe=False gives the model an inference lock that callers take via inference_lock(name)."""
+        self._loaders[name] = loader
+        self._warmups[name] = warmup
+        self._version_fns[name] = version
+        self._locks[name] = threading.Lock()
+        if not thread_safe:
+            self._inference_locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._loaders)
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model '{name}'")
+
+        # Only one thread loads a given artifact; the others wait for it
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+
+            start = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+                warmup = self._warmups[name]
+                if warmup is not None:
+                    warmup(model)
+            except Exception as e:
+                self._errors[name] = str(e)
+                logging.error(f"Failed to load model '{name}': {str(e)}")
+                raise
+
+            self._load_times[name] = time.perf_counter() - start
+            self._errors.pop(name, None)
+            self._record_version(name, model)
+            self._models[name] = model
+            logging.info(f"Loaded model '{name}' in {self._load_times[name]:.2f}s")
+            return model
+
+    def override(self, name, model, warmup=True):
+        """Install an already built model (e.g. a stand-in for benchmarks) instead of loading it."""
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model '{name}'")
+        with self._locks[name]:
+            start = time.perf_counter()
+            if warmup and self._warmups[name] is not None:
+                self._warmups[name](model)
+            self._models[name] = model
+            self._load_times[name] = time.perf_counter() - start
+            self._errors.pop(name, None)
+            self._record_version(name, model)
+
+    def _record_version(self, name, model):
+        version = self._version_fns[name]
+        self._versions[name] = version(model) if version is not None else None
+
+    def version(self, name):
+        """Version recorded when `name` was loaded; loads it first if needed."""
+        self.get(name)
+        return self._versions.get(name)
+
+    def inference_lock(self, name):
+        """
+        Lock to hold around every call into a model registered with
+        thread_safe=False; a no-op context for the others.
+        """
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model '{name}'")
+        return self._inference_locks.get(name) or contextlib.nullcontext()
+
+    def invalidate(self, name):
+        """Drop a loaded artifact so the next get() reloads it from disk."""
+        with self._locks[name]:
+            self._models.pop(name, None)
+            self._load_times.pop(name, None)
+            self._versions.pop(name, None)
+
+    def load_all(self):
+        for name in self.names():
+            try:
+                self.get(name)
+            except Exception:
+                continue
+
+    def is_loaded(self, name=None):
+        if name is not None:
+            return name in self._models
+        return all(n in self._models for n in self._loaders)
+
+    def is_ready(self, name=None):
+        """Whether requests needing `name` (or every model) can be served."""
+        if name is not None:
+            return name in self._models or name not in self._errors
+        return all(self.is_ready(n) for n in self._loaders)
+
+    def status(self):
+        return {
+            name: {
+                "loaded": name in self._models,
+                "ready": self.is_ready(name),
+                "load_seconds": round(self._load_times[name], 3) if name in self._load_times else None,
+                "error": self._errors.get(name),
+                "version": self._versions.get(name),
+            }
+            for name in self._loaders
+        }
+
+
+# Loaders. torch, ultralytics, sentence-transformers and joblib are imported
+# here rather than at module level, so importing the app stays cheap until a
+# model is actually needed.
+
+def _load_classifier():
+    from .inference_backend import load_inference_classifier
+
+    # Eager ResNet unless NEPHROSCAN_CLASSIFIER_BACKEND names a parity-approved backend
+    return load_inference_classifier(CLASSIFIER_PATH, checkpoint_fingerprint(CLASSIFIER_PATH))
+
+
+def _classifier_version(model):
+    # Set by load_inference_classifier; stand-ins installed via override() are eager
+    backend = getattr(model, "backend", "eager")
+    compiled_path = getattr(model, "compiled_path", None)
+    artifacts = [CLASSIFIER_PATH] if compiled_path is None else [CLASSIFIER_PATH, compiled_path, APPROVAL_PATH]
+    return checkpoint_fingerprint(*artifacts) + "-" + backend
+
+
+def _load_localizer():
+    from ultralytics import YOLO
+
+    return YOLO(LOCALIZER_PATH)
+
+
+def _load_embedder():
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDER_NAME)
+
+
+def _load_faiss_index():
+    # Memory-mapped where the index type allows it (see rag_store)
+    return load_index()
+
+
+def _load_risk_model():
+    import joblib
+
+    return joblib.load(RISK_MODEL_PATH)
+
+
+def _load_risk_scaler():
+    import joblib
+
+    return joblib.load(RISK_SCALER_PATH)
+
+
+def _load_risk_predictor():
+    # Compiled forest once it has passed the parity check, else scaler + forest from sklearn
+    return load_risk_predictor(checkpoint_fingerprint(RISK_MODEL_PATH, RISK_SCALER_PATH),
+                               lambda: registry.get("risk_model"), lambda: registry.get("risk_scaler"))
+
+
+# Warm-ups: one throwaway inference so the first real request does not pay
+# for lazy graph setup, allocator growth, etc.
+
+def _warmup_classifier(model):
+    import torch
+
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 224, 224))
+
+
+def _warmup_localizer(model):
+    model(np.zeros((512, 512, 3), dtype=np.uint8), conf=0.15, verbose=False)
+
+
+def _warmup_embedder(model):
+    model.encode(["kidney"])
+
+
+def _warmup_faiss_index(index):
+    if index.ntotal > 0:
+        index.search(np.zeros((1, index.d), dtype=np.float32), 1)
+
+
+def _warmup_risk_model(model):
+    model.predict(np.zeros((1, model.n_features_in_)))
+
+
+def _warmup_risk_scaler(scaler):
+    scaler.transform(np.ones((1, scaler.n_features_in_)))
+
+
+def _warmup_risk_predictor(predictor):
+    predictor.predict(np.ones((1, predictor.n_features_in_)))
+
+
+def _warmup_spell_checker(checker):
+    checker.correct("kidny stone")
+
+
+registry = ModelRegistry()
+registry.register("classifier", _load_classifier, _warmup_classifier, version=_classifier_version)
+# ultralytics' predictor keeps per-call state (batch, results) on the instance,
+# so concurrent predict() calls on one YOLO object can mix up their boxes
+registry.register("localizer", _load_localizer, _warmup_localizer, thread_safe=False,
+                  version=lambda model: checkpoint_fingerprint(LOCALIZER_PATH))
+registry.register("embedder", _load_embedder, _warmup_embedder)
+registry.register("faiss_index", _load_faiss_index, _warmup_faiss_index)
+registry.register("rag_chunks", load_chunks)
+registry.register("lexical_index", lambda: load_lexical_index(registry.get("rag_chunks")))
+registry.register("risk_model", _load_risk_model, _warmup_risk_model)
+registry.register("risk_scaler", _load_risk_scaler, _warmup_risk_scaler)
+registry.register("risk_predictor", _load_risk_predictor, _warmup_risk_predictor)
+registry.register("spell_checker", load_spell_checker, _warmup_spell_checker)
+# Prototype embeddings are computed once with the resident embedder
+registry.register("intent_router", lambda: IntentRouter(registry.get("embedder")))
@@ -0,0 +1,285 @@
+# app/utils/pdf_export.py
+"""
+Server-side PDF reports.
+
+report_pdf.html is compiled once per process and rendered to PDF with
+WeasyPrint on a small worker pool. Each PDF is cached on disk keyed by the
+analysis result and the template version, so a report is rendered at most
+once however often it is downloaded. Static assets referenced by the
+template (fonts, logos, the annotated scan) are read through an in-memory
+cache. Batch exports run on their own job queue and write a zip under
+EXPORT_DIR, so request threads never wait for them; the job's status and
+archive name are kept in the shared state database, so any worker can
+report on and serve an export.
+
+WeasyPrint is optional; without it /report.pdf answers 503 and the browser
+download on the preview page keeps working.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import mimetypes
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse, unquote
+
+from .jobs import JobQueue, state_db
+from .query_cache import TTLCache
+from .localization import map_coordinates_to_regions
+from .pipeline import ensure_annotated_image
+
+TEMPLATE_NAME = "report_pdf.html"
+REPORT_CACHE_DIR = os.environ.get("NEPHROSCAN_REPORT_CACHE_DIR", os.path.join("cache", "reports"))
+REPORT_CACHE_BYTES = int(os.environ.get("NEPHROSCAN_REPORT_CACHE_MB", "256")) * 1024 * 1024
+EXPORT_DIR = os.environ.get("NEPHROSCAN_EXPORT_DIR", os.path.join("cache", "exports"))
+EXPORT_TTL_SECONDS = int(os.environ.get("NEPHROSCAN_EXPORT_TTL_SECONDS", "3600"))
+EXPORT_MAX_REPORTS = int(os.environ.get("NEPHROSCAN_EXPORT_MAX_REPORTS", "500"))
+PDF_WORKERS = int(os.environ.get("NEPHROSCAN_PDF_WORKERS", "2"))
+ASSET_CACHE_ENTRIES = 64
+# Stands in for current_time in cached HTML; survives autoescaping unchanged
+TIME_PLACEHOLDER = "__NEPHROSCAN_CURRENT_TIME__"
+
+
+class PdfUnavailable(RuntimeError):
+    pass
+
+
+def report_context(analysis):
+    """Template variables for one analysis (the same ones /pdf_preview shows)."""
+    return {
+        "analysis_id": analysis.get("analysis_id"),
+        "label": analysis["label"],
+        "report": analysis["report"],
+        "regions": map_coordinates_to_regions(analysis["boxes"]),
+        # Burned-in annotation is only produced for the PDF path
+        "localized_image_url": ensure_annotated_image(analysis),
+    }
+
+
+class ReportRenderer:
+    def __init__(self, cache_dir=REPORT_CACHE_DIR, max_disk_bytes=REPORT_CACHE_BYTES, workers=PDF_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.app = None
+        self.template_version = None
+        self._template = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-render")
+        self._inflight = {}
+        self._disk = OrderedDict()  # key -> size in bytes, oldest first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._html = TTLCache(maxsize=256)
+        self._assets = OrderedDict()
+        self._assets_lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {"hits": 0, "renders": 0, "failures": 0}
+
+    def init_app(self, app):
+        """Compile the template once and index PDFs cached for this template version."""
+        source = app.jinja_loader.get_source(app.jinja_env, TEMPLATE_NAME)[0]
+        self.app = app
+        self.template_version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        self._template = app.jinja_env.get_template(TEMPLATE_NAME)
+
+        version_dir = self._version_dir()
+        os.makedirs(version_dir, exist_ok=True)
+        for name in os.listdir(self.cache_dir):
+            if name != self.template_version:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+        entries = []
+        for name in os.listdir(version_dir):
+            st = os.stat(os.path.join(version_dir, name))
+            entries.append((st.st_mtime, name[:-len(".pdf")], st.st_size))
+        with self._lock:
+            for _, key, size in sorted(entries):
+                self._disk[key] = size
+                self._disk_bytes += size
+
+    def _version_dir(self):
+        return os.path.join(self.cache_dir, self.template_version)
+
+    def _path(self, key):
+        return os.path.join(self._version_dir(), key + ".pdf")
+
+    def key(self, context):
+        data = json.dumps(context, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(self.template_version.encode() + data).hexdigest()
+
+    def render_html(self, context, pdf_export=False):
+        """
+        Rendered report_pdf.html; cached, since the preview is opened
+        repeatedly. The cached copy holds a placeholder for the timestamp,
+        which is filled in on every call.
+        """
+        key = (self.key(context), pdf_export)
+        html = self._html.get(key)
+        if html is None:
+            with self.app.test_request_context("/"):
+                html = self._template.render(**context, pdf_export=pdf_export, current_time=TIME_PLACEHOLDER)
+            self._html.put(key, html)
+        return html.replace(TIME_PLACEHOLDER, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def submit(self, context):
+        """Future resolving to the path of the cached PDF for this context."""
+        key = self.key(context)
+        with self._lock:
+            try:
+                size = os.path.getsize(self._path(key))
+            except OSError:
+                size = None
+            # The file may have been rendered by another worker
+            if size is not None:
+                self._disk_bytes += size - self._disk.pop(key, 0)
+                self._disk[key] = size
+                self.counters["hits"] += 1
+                future = Future()
+                future.set_result(self._path(key))
+                return future
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._pool.submit(self._render, key, context)
+                self._inflight[key] = future
+            return future
+
+    def render(self, context, timeout=None):
+        return self.submit(context).result(timeout=timeout)
+
+    def _render(self, key, context):
+        path = self._path(key)
+        try:
+            try:
+                from weasyprint import HTML
+            except ImportError:
+                raise PdfUnavailable("WeasyPrint is not installed")
+
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            HTML(string=self.render_html(context, pdf_export=True), base_url="file:///",
+                 url_fetcher=self._fetch).write_pdf(tmp_path, font_config=self._font_config())
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception:
+            with self._lock:
+                self.counters["failures"] += 1
+                self._inflight.pop(key, None)
+            raise
+
+        with self._lock:
+            self.counters["renders"] += 1
+            self._inflight.pop(key, None)
+            self._disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+        return path
+
+    def _font_config(self):
+        # Font discovery is the slow part of WeasyPrint start-up; keep one per worker thread
+        config = getattr(self._local, "font_config", None)
+        if config is None:
+            try:
+                from weasyprint.text.fonts import FontConfiguration
+            except ImportError:
+                from weasyprint.fonts import FontConfiguration
+            config = self._local.font_config = FontConfiguration()
+        return config
+
+    def _fetch(self, url):
+        """Serve /static/... from the static folder, keeping recently used assets in memory."""
+        parsed = urlparse(url)
+        static_url = self.app.static_url_path.rstrip("/") + "/"
+        if parsed.scheme != "file" or not parsed.path.startswith(static_url):
+            from weasyprint import default_url_fetcher
+            return default_url_fetcher(url)
+
+        rel_path = unquote(parsed.path[len(static_url):])
+        path = os.path.realpath(os.path.join(self.app.static_folder, rel_path))
+        if not path.startswith(os.path.realpath(self.app.static_folder) + os.sep):
+            raise ValueError(f"Refusing to read {url} outside the static folder")
+        cache_key = (path, os.stat(path).st_mtime_ns)
+        with self._assets_lock:
+            data = self._assets.get(cache_key)
+            if data is not None:
+                self._assets.move_to_end(cache_key)
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+            with self._assets_lock:
+                self._assets[cache_key] = data
+                while len(self._assets) > ASSET_CACHE_ENTRIES:
+                    self._assets.popitem(last=False)
+        return {"string": data, "mime_type": mimetypes.guess_type(path)[0], "redirected_url": url}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update({
+                "template_version": self.template_version,
+                "in_flight": len(self._inflight),
+                "cached_reports": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            })
+        stats["html"] = self._html.stats()
+        return stats
+
+
+def export_reports(analyses, progress):
+    """
+    Export job: render every analysis (in parallel on the PDF pool) and write
+    them to one zip. `analyses` is a list of (analysis_id, analysis or None).
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _sweep_exports()
+
+    futures, missing = [], []
+    for analysis_id, analysis in analyses:
+        if analysis is None:
+            missing.append(analysis_id)
+        else:
+            futures.append((analysis_id, analysis["label"], report_renderer.submit(report_context(analysis))))
+
+    name = f"nephroscan_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}.zip"
+    tmp_path = os.path.join(EXPORT_DIR, name + ".tmp")
+    failed = []
+    # PDFs are already compressed; storing them keeps the zip step I/O bound
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for i, (analysis_id, label, future) in enumerate(futures, 1):
+            try:
+                archive.write(future.result(), f"NephroScan_{label}_{analysis_id[:12]}.pdf")
+            except Exception as e:
+                logging.error(f"Report export for {analysis_id} failed: {str(e)}")
+                failed.append(analysis_id)
+            progress(f"rendered {i}/{len(futures)}")
+    os.replace(tmp_path, os.path.join(EXPORT_DIR, name))
+    return {"archive": name, "reports": len(futures) - len(failed), "missing": missing, "failed": failed}
+
+
+def export_path(name):
+    path = os.path.join(EXPORT_DIR, os.path.basename(name))
+    return path if name.endswith(".zip") and os.path.exists(path) else None
+
+
+def _sweep_exports():
+    cutoff = time.time() - EXPORT_TTL_SECONDS
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+report_renderer = ReportRenderer()
+# Job rows expire with the archives they point to
+export_queue = JobQueue(state_db, kind="export", workers=1, maxsize=8, ttl=EXPORT_TTL_SECONDS)
@@ -0,0 +1,173 @@
+# app/utils/pipeline.py
+import os
+import time
+import uuid
+
+from .batching import classifier_service
+from .imaging import decode_image, to_classifier_tensor, safe_upload_name, persist_upload
+from .localization import localize_kidney, draw_boxes
+from .result_cache import result_cache, image_key
+from .speculation import speculative_localizer
+from .report import generate_medical_report
+from .artifacts import artifact_store
+from .metrics import span
+from .renditions import OVERLAY_MODE, client_overlay, save_renditions, renditions_exist, burn_in_annotation
+
+LOCALIZED_DIR = os.path.join("static", "localized")
+
+
+def _noop(stage):
+    pass
+
+
+def run_analysis(data, filename, progress=None):
+    """
+    Full upload flow shared by the form route and the async job queue:
+    decode once, persist in the background, analyze and build the report.
+    `progress` is called with the name of each stage as it starts.
+    """
+    progress = progress or _noop
+    analysis_id = uuid.uuid4().hex
+    progress("decoding")
+    # Decode once; the same buffer feeds the classifier and YOLO
+    with span("upload.decode"):
+        image = decode_image(data)
+    # Prefix with the analysis id so concurrent uploads never share a file
+    safe_filename = f"{analysis_id[:12]}_{safe_upload_name(filename)}"
+    with span("upload.persist_enqueue"):
+        persist_upload(data, safe_filename, analysis_id)
+
+    result = analyze_image(image, safe_filename, progress, analysis_id)
+
+    progress("reporting")
+    with span("upload.report"):
+        result["report"] = generate_medical_report(result["label"], len(result["boxes"]))
+    result["analysis_id"] = analysis_id
+    return result
+
+
+def analyze_image(image, safe_filename, progress=None, analysis_id=None):
+    """
+    Run classification and, for abnormal scans, YOLO localization on an
+    already decoded RGB array.
+    Returns a dict with label, probabilities, boxes, image_size and either
+    renditions (client overlay mode) or localized_image_url (server mode).
+    Repeated uploads of the same pixels are served from the result cache.
+    """
+    progress = progress or _noop
+    client_mode = client_overlay()
+    progress("cache_lookup")
+    with span("upload.cache_lookup"):
+        key = image_key(image)
+        cached = result_cache.get(key)
+    if cached is not None and cached.get("overlay_mode") == OVERLAY_MODE:
+        result = dict(cached)
+        if _restore_images(result, image, safe_filename, analysis_id):
+            result_cache.put(key, result)
+        if analysis_id is not None:
+            # The images belong to the analysis that first produced them
+            artifact_store.link(_image_urls(result), analysis_id)
+        return dict(result, cached=True)
+
+    # Start YOLO speculatively alongside the classifier; most scans are abnormal
+    started_at = time.perf_counter()
+    annotate = not client_mode
+    speculative = speculative_localizer.start(image, annotate) if speculative_localizer.should_speculate() else None
+
+    progress("classifying")
+    try:
+        with span("upload.classify"):
+            input_tensor = to_classifier_tensor(image)
+            predicted_label, probabilities = classifier_service.classify(input_tensor)
+    except Exception:
+        if speculative is not None:
+            speculative_localizer.discard(speculative)
+        raise
+    classify_seconds = time.perf_counter() - started_at
+    speculative_localizer.observe(predicted_label)
+
+    # Localization if abnormal
+    boxes = []
+    localized_image_url = None
+    renditions = None
+    if predicted_label == "normal" and speculative is not None:
+        speculative_localizer.discard(speculative)
+    if predicted_label != "normal":
+        # Old annotated images are evicted by the artifact store's sweeper
+        # YOLOv8 localization on the shared buffer
+        progress("localizing")
+        with span("upload.localize"):
+            if speculative is not None:
+                boxes, localized_image = speculative_localizer.collect(speculative, classify_seconds, started_at)
+            else:
+                boxes, localized_image = localize_kidney(image, annotate=annotate)
+
+        progress("rendering")
+        with span("upload.encode_images"):
+            if client_mode:
+                # One compact rendition; the browser draws the boxes over it
+                renditions = save_renditions(image, safe_filename, analysis_id, boxes)
+            else:
+                localized_image_url = _save_localized(localized_image, safe_filename, analysis_id)
+
+    result = {
+        "label": predicted_label,
+        "probabilities": probabilities,
+        "boxes": boxes,
+        "image_size": [int(image.shape[1]), int(image.shape[0])],
+        "overlay_mode": OVERLAY_MODE,
+        "renditions": renditions,
+        "localized_image_url": localized_image_url,
+    }
+    result_cache.put(key, result)
+    return dict(result, cached=False)
+
+
+def _restore_images(result, image, safe_filename, analysis_id):
+    """
+    Re-create image files of a cached result that were evicted from disk,
+    from the cached boxes and without rerunning YOLO. Returns True if any
+    file was rewritten.
+    """
+    if result["renditions"] and not renditions_exist(result["renditions"]):
+        result["renditions"] = save_renditions(image, safe_filename, analysis_id, result["boxes"])
+        return True
+    url = result["localized_image_url"]
+    if url and not os.path.exists(os.path.join("static", url)):
+        result["localized_image_url"] = _save_localized(draw_boxes(image, result["boxes"]), safe_filename, analysis_id)
+        return True
+    return False
+
+
+def _image_urls(result):
+    urls = list((result.get("renditions") or {}).values())
+    if result.get("localized_image_url"):
+        urls.append(result["localized_image_url"])
+    return urls
+
+
+def ensure_annotated_image(analysis):
+    """
+    PDF export still needs the boxes burned into the image. In client overlay
+    mode this is produced on demand from the cached rendition.
+    """
+    url = analysis.get("localized_image_url")
+    if url and os.path.exists(os.path.join("static", url)):
+        return url
+    if analysis.get("renditions"):
+        analysis["localized_image_url"] = burn_in_annotation(analysis, analysis.get("analysis_id"))
+    return analysis.get("localized_image_url")
+
+
+def _save_localized(localized_image, safe_filename, analysis_id=None):
+    os.makedirs(LOCALIZED_DIR, exist_ok=True)
+    timestamp = int(time.time())
+    localized_filename = f"{safe_filename}_{timestamp}_localized.png"
+    localized_path = os.path.join(LOCALIZED_DIR, localized_filename)
+
+    # Save the image with annotations (rectangle, region name)
+    localized_image.save(localized_path)
+
+    localized_image_url = os.path.join("localized", localized_filename).replace("\\", "/")
+    artifact_store.add(localized_image_url, "localized", analysis_id)
+    return localized_image_url
@@ -0,0 +1,98 @@
+# app/utils/query_cache.py
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .microbatch import MicroBatcher
+
+QUERY_CACHE_ENTRIES = int(os.environ.get("NEPHROSCAN_QUERY_CACHE_ENTRIES", "2048"))
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get("NEPHROSCAN_QUERY_CACHE_TTL_SECONDS", "3600"))
+ENCODE_WINDOW_MS = float(os.environ.get("NEPHROSCAN_ENCODE_WINDOW_MS", "5"))
+ENCODE_MAX_BATCH = int(os.environ.get("NEPHROSCAN_ENCODE_MAX_BATCH", "32"))
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Case, punctuation and whitespace differences map to the same cache key."""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", query.lower())).strip()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=QUERY_CACHE_ENTRIES, ttl=QUERY_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] >= time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class EncodeCoalescer(MicroBatcher):
+    """
+    Batches concurrent SentenceTransformer.encode calls. Each caller submits
+    one string; a background thread waits up to `window_ms` for others and
+    encodes them all in one call.
+    """
+
+    name = "encode-coalescer"
+
+    def __init__(self, embedder_getter, window_ms=ENCODE_WINDOW_MS, max_batch_size=ENCODE_MAX_BATCH):
+        super().__init__(window_ms, max_batch_size)
+        self._embedder_getter = embedder_getter
+
+    def encode(self, text, timeout=None):
+        """Return the embedding (1-D float32 array) for a single string."""
+        return self.submit(text).result(timeout=timeout)
+
+    def process(self, texts):
+        return np.asarray(self._embedder_getter().encode(texts), dtype=np.float32)
+
+    def stats(self):
+        stats = super().stats()
+        return {
+            "queue_depth": stats["queue_depth"],
+            "encode_calls": stats["batches"],
+            "texts_encoded": stats["items"],
+            "mean_batch_size": stats["mean_batch_size"],
+        }
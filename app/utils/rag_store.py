@@ -0,0 +1,165 @@
+# app/utils/rag_store.py
+"""
+On-disk layout of the versioned RAG index written by rag/build_index.py:
+
+    rag/index/CURRENT                  name of the active version, e.g. "v0003"
+    rag/index/v0003/index.faiss        FAISS index; vector id == chunk id
+    rag/index/v0003/chunks.bin         all chunk texts, utf-8, back to back
+    rag/index/v0003/offsets.npy        int64 (n, 2) array of (offset, length)
+    rag/index/v0003/sources.npy        int32 (n,) array: chunk id -> source number
+    rag/index/v0003/sources.json       source names, one per document
+    rag/index/v0003/manifest.json      version, index type, sources, chunk hashes
+                                       (build metadata; not read by the server)
+    rag/index/v0003/bm25.pkl           BM25 inverted index over the same chunk ids
+    rag/index/embedding_cache.npy      float32 embeddings keyed by chunk hash
+    rag/index/embedding_cache.txt      one chunk hash per row of the cache
+
+The server memory-maps the index, the chunk texts, the offsets and the
+per-chunk source numbers, so every worker shares the same page cache instead
+of holding its own copy; only the per-document source names are read into
+memory. Builds keep the newest KEEP_VERSIONS versions. Without
+rag/index/CURRENT it falls back to the legacy faiss_index.faiss and
+index_documents.txt pair.
+"""
+import os
+import mmap
+import json
+import shutil
+import logging
+
+import numpy as np
+
+from .lexical import BM25Index
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAG_DIR = os.path.join(BASE_DIR, "../../rag/")
+INDEX_ROOT = os.path.join(RAG_DIR, "index")
+CURRENT_PATH = os.path.join(INDEX_ROOT, "CURRENT")
+LEGACY_INDEX_PATH = os.path.join(RAG_DIR, "faiss_index.faiss")
+LEGACY_DOCS_PATH = os.path.join(RAG_DIR, "index_documents.txt")
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "offsets.npy"
+MANIFEST_FILE = "manifest.json"
+LEXICAL_FILE = "bm25.pkl"
+SOURCE_IDS_FILE = "sources.npy"
+SOURCE_NAMES_FILE = "sources.json"
+# CURRENT plus the previous build, for rollback
+KEEP_VERSIONS = 2
+
+
+def current_version_dir():
+    try:
+        with open(CURRENT_PATH, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(INDEX_ROOT, version)
+    return path if os.path.isdir(path) else None
+
+
+def index_paths():
+    """Files whose change means the served index changed."""
+    version_dir = current_version_dir()
+    if version_dir is None:
+        return (LEGACY_INDEX_PATH, LEGACY_DOCS_PATH)
+    return (CURRENT_PATH, os.path.join(version_dir, INDEX_FILE))
+
+
+class ChunkStore:
+    """Read-only, memory-mapped sequence of chunk texts indexed by chunk id."""
+
+    def __init__(self, version_dir):
+        self.version_dir = version_dir
+        self._file = open(os.path.join(version_dir, CHUNKS_FILE), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._offsets = np.load(os.path.join(version_dir, OFFSETS_FILE), mmap_mode="r")
+        self._source_names = None
+        source_ids = os.path.join(version_dir, SOURCE_IDS_FILE)
+        self._source_ids = np.load(source_ids, mmap_mode="r") if os.path.exists(source_ids) else None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        offset, length = self._offsets[i]
+        return self._data[int(offset):int(offset) + int(length)].decode("utf-8")
+
+    def source(self, i):
+        """Document a chunk came from, or None for versions built without source ids."""
+        if self._source_ids is None:
+            return None
+        if self._source_names is None:
+            with open(os.path.join(self.version_dir, SOURCE_NAMES_FILE), "r", encoding="utf-8") as f:
+                self._source_names = json.load(f)
+        return self._source_names[int(self._source_ids[i])]
+
+
+def load_chunks():
+    version_dir = current_version_dir()
+    if version_dir is None:
+        with open(LEGACY_DOCS_PATH, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return ChunkStore(version_dir)
+
+
+def load_index():
+    import faiss
+
+    version_dir = current_version_dir()
+    path = LEGACY_INDEX_PATH if version_dir is None else os.path.join(version_dir, INDEX_FILE)
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        # Not every index type supports mmap (e.g. HNSW graphs)
+        logging.info(f"Memory-mapping {path} not supported ({str(e).splitlines()[0]}); reading it fully")
+        return faiss.read_index(path)
+
+
+def load_lexical_index(chunks=None):
+    """BM25 index built with the FAISS index, or built in memory for the legacy layout."""
+    version_dir = current_version_dir()
+    if version_dir is not None and os.path.exists(os.path.join(version_dir, LEXICAL_FILE)):
+        return BM25Index.load(os.path.join(version_dir, LEXICAL_FILE))
+    chunks = chunks if chunks is not None else load_chunks()
+    return BM25Index.build([chunks[i] for i in range(len(chunks))])
+
+
+def write_chunk_store(version_dir, texts, sources=None):
+    """sources: optional per-chunk source names, stored as numbers into a per-document list."""
+    offsets = np.zeros((len(texts), 2), dtype=np.int64)
+    position = 0
+    with open(os.path.join(version_dir, CHUNKS_FILE), "wb") as f:
+        for i, text in enumerate(texts):
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets[i] = (position, len(data))
+            position += len(data)
+    np.save(os.path.join(version_dir, OFFSETS_FILE), offsets)
+    if sources is not None:
+        names = list(dict.fromkeys(sources))
+        number = {name: i for i, name in enumerate(names)}
+        np.save(os.path.join(version_dir, SOURCE_IDS_FILE), np.array([number[s] for s in sources], dtype=np.int32))
+        with open(os.path.join(version_dir, SOURCE_NAMES_FILE), "w", encoding="utf-8") as f:
+            json.dump(names, f)
+
+
+def prune_versions(keep=KEEP_VERSIONS):
+    """
+    Delete all but the newest `keep` vNNNN directories, never the one CURRENT
+    names. Workers still serving an older version keep their mmaps valid, as
+    unlinked files stay readable until unmapped. Returns the removed names.
+    """
+    current = current_version_dir()
+    current = os.path.basename(current) if current else None
+    versions = sorted((d for d in os.listdir(INDEX_ROOT) if d.startswith("v") and d[1:].isdigit()),
+                      key=lambda d: int(d[1:]), reverse=True)
+    removed = []
+    for name in versions[max(1, keep):]:
+        if name == current:
+            continue
+        shutil.rmtree(os.path.join(INDEX_ROOT, name), ignore_errors=True)
+        removed.append(name)
+    return removed
@@ -0,0 +1,85 @@
+# app/utils/renditions.py
+import os
+import logging
+
+from PIL import Image, features
+
+from .artifacts import artifact_store
+from .localization import draw_boxes
+
+# "client": the browser draws boxes over a cached WebP/JPEG rendition.
+# "server": annotated full-resolution PNG burned in on every abnormal scan.
+OVERLAY_MODE = os.environ.get("NEPHROSCAN_OVERLAY_MODE", "client")
+RENDITION_DIR = os.path.join("static", "renditions")
+RENDITION_SIZES = {"full": 1024, "thumb": 256}
+RENDITION_QUALITY = int(os.environ.get("NEPHROSCAN_RENDITION_QUALITY", "80"))
+
+if features.check("webp"):
+    RENDITION_FORMAT, RENDITION_EXT = "WEBP", ".webp"
+else:
+    RENDITION_FORMAT, RENDITION_EXT = "JPEG", ".jpg"
+
+
+def client_overlay():
+    return OVERLAY_MODE == "client"
+
+
+def save_renditions(image, safe_filename, analysis_id=None, boxes=()):
+    """
+    Encode the decoded scan once per size variant (long side capped at the
+    variant size, never upscaled). Returns {variant: static-relative url}.
+    The full rendition is indexed with the boxes to draw over it, so it can
+    be listed alongside server-annotated images; thumbnails as "thumbnail".
+    """
+    os.makedirs(RENDITION_DIR, exist_ok=True)
+    source = Image.fromarray(image)
+    stem = os.path.splitext(safe_filename)[0]
+    urls = {}
+    for variant, max_side in RENDITION_SIZES.items():
+        rendition = source
+        if max(source.size) > max_side:
+            rendition = source.copy()
+            rendition.thumbnail((max_side, max_side), Image.BILINEAR)
+        filename = f"{stem}_{variant}{RENDITION_EXT}"
+        rendition.save(os.path.join(RENDITION_DIR, filename), RENDITION_FORMAT, quality=RENDITION_QUALITY)
+        url = f"renditions/{filename}"
+        if variant == "full":
+            meta = {"boxes": [[float(v) for v in box] for box in boxes],
+                    "image_size": [int(image.shape[1]), int(image.shape[0])]}
+            artifact_store.add(url, "rendition", analysis_id, meta=meta)
+        else:
+            artifact_store.add(url, "thumbnail", analysis_id)
+        urls[variant] = url
+    return urls
+
+
+def renditions_exist(renditions):
+    return bool(renditions) and all(os.path.exists(os.path.join("static", u)) for u in renditions.values())
+
+
+def burn_in_annotation(analysis, analysis_id=None):
+    """
+    PDF path only: draw the boxes onto the full rendition and save a PNG in
+    static/localized. Boxes are in original-image pixels, so they are scaled
+    to the rendition size first. Returns the static-relative url or None.
+    """
+    renditions = analysis.get("renditions")
+    if not renditions_exist(renditions):
+        return None
+    try:
+        with Image.open(os.path.join("static", renditions["full"])) as im:
+            image = im.convert("RGB")
+    except OSError as e:
+        logging.error(f"Failed to open rendition for annotation: {str(e)}")
+        return None
+
+    width, height = analysis["image_size"]
+    sx, sy = image.width / width, image.height / height
+    boxes = [[x1 * sx, y1 * sy, x2 * sx, y2 * sy] for x1, y1, x2, y2 in analysis["boxes"]]
+
+    os.makedirs(os.path.join("static", "localized"), exist_ok=True)
+    stem = os.path.splitext(os.path.basename(renditions["full"]))[0]
+    url = f"localized/{stem}_localized.png"
+    draw_boxes(image, boxes).save(os.path.join("static", url))
+    artifact_store.add(url, "localized", analysis_id)
+    return url
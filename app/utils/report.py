@@ -1,15 +1,19 @@
 from datetime import datetime
+from functools import lru_cache
+
+TREATMENTS = {
+    "cyst": "- Usually observation unless painful or large\n- Aspiration or surgery if needed",
+    "stone": "- Hydration and pain control\n- Shock wave lithotripsy or ureteroscopy",
+    "tumor": "- Biopsy and staging\n- Surgery, ablation or targeted therapy",
+    "normal": "✅ No abnormalities detected."
+}
 
 def generate_medical_report(predicted_label, num_boxes):
-    today = datetime.today().strftime('%Y-%m-%d')
-    label_map = {
-        "cyst": "- Usually observation unless painful or large\n- Aspiration or surgery if needed",
-        "stone": "- Hydration and pain control\n- Shock wave lithotripsy or ureteroscopy",
-        "tumor": "- Biopsy and staging\n- Surgery, ablation or targeted therapy",
-        "normal": "✅ No abnormalities detected."
-    }
-
-    treatment = label_map.get(predicted_label, "Consult a specialist.")
+    return _medical_report(predicted_label, num_boxes, datetime.today().strftime('%Y-%m-%d'))
+
+@lru_cache(maxsize=256)
+def _medical_report(predicted_label, num_boxes, today):
+    treatment = TREATMENTS.get(predicted_label, "Consult a specialist.")
     return f"""
 🩺 Nephrology Diagnostic Report – {today}
 -----------------------------------------
@@ -20,4 +24,41 @@ def generate_medical_report(predicted_label, num_boxes):
 {treatment}
 
 📍 Note: Kindly follow up with a certified nephrologist.
-"""
\ No newline at end of file
+"""
+
+def generate_study_report(study):
+    """
+    Study-level variant of generate_medical_report.
+    study: the dict returned by study.analyze_study.
+    """
+    today = datetime.today().strftime('%Y-%m-%d')
+    verdict = study["verdict"]
+    treatment = TREATMENTS.get(verdict, "Consult a specialist.")
+
+    counts = "\n".join(
+        f"   - {label.upper()}: {count}" for label, count in study["label_counts"].items() if count
+    ) or "   - none"
+    key_slices = "\n".join(
+        f"   - {s['slice']} ({s['label']}, {s['confidence'] * 100:.1f}%, {len(s['boxes'])} region(s))"
+        for s in study["key_slices"]
+    ) or "   - none"
+
+    return f"""
+🩺 Nephrology Study Report – {today}
+-----------------------------------------
+🔹 Study Verdict: {verdict.upper()}
+🔹 Slices Analyzed: {study["num_slices"]}
+🔹 Abnormal Slices: {study["abnormal_slices"]}
+🔹 Abnormal Regions Detected: {study["total_boxes"]}
+
+🧩 Slice Classification:
+{counts}
+
+🔍 Key Slices:
+{key_slices}
+
+📄 Recommended Actions:
+{treatment}
+
+📍 Note: Kindly follow up with a certified nephrologist.
+"""
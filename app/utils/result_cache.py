@@ -0,0 +1,189 @@
+# app/utils/result_cache.py
+import os
+import json
+import shutil
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from .model_registry import APPROVAL_PATH, CLASSIFIER_PATH, LOCALIZER_PATH, checkpoint_fingerprint, registry
+
+CACHE_DIR = os.environ.get("NEPHROSCAN_RESULT_CACHE_DIR", os.path.join("cache", "results"))
+MEMORY_ENTRIES = int(os.environ.get("NEPHROSCAN_RESULT_CACHE_ENTRIES", "256"))
+DISK_BYTES = int(os.environ.get("NEPHROSCAN_RESULT_CACHE_DISK_MB", "64")) * 1024 * 1024
+
+
+def image_key(image):
+    """Content hash of the decoded pixels (shape included), independent of file format."""
+    h = hashlib.sha256()
+    h.update(str(image.shape).encode())
+    h.update(np.ascontiguousarray(image))
+    return h.hexdigest()
+
+
+def _model_files():
+    return checkpoint_fingerprint(CLASSIFIER_PATH, LOCALIZER_PATH, APPROVAL_PATH)
+
+
+MODEL_CHECK_SECONDS = 5.0
+_model_state = {"files": _model_files(), "checked": time.monotonic()}
+_model_lock = threading.Lock()
+
+
+def _check_model_files():
+    """Reload the classifier and localizer once their files on disk change."""
+    now = time.monotonic()
+    if now - _model_state["checked"] < MODEL_CHECK_SECONDS:
+        return
+    with _model_lock:
+        _model_state["checked"] = now
+        files = _model_files()
+        if files == _model_state["files"]:
+            return
+        _model_state["files"] = files
+        registry.invalidate("classifier")
+        registry.invalidate("localizer")
+
+
+def model_fingerprint():
+    """
+    Versions of the classifier (checkpoint, backend and compiled model) and
+    localizer the registry actually loaded; changes when either is reloaded.
+    """
+    _check_model_files()
+    return registry.version("classifier") + "-" + registry.version("localizer")
+
+
+class ResultCache:
+    """
+    Two-tier cache of analysis results keyed by pixel hash.
+    Tier 1 is an in-memory LRU, tier 2 a size-bounded directory of JSON files.
+    Entries are namespaced by the model fingerprint, so swapping either
+    checkpoint or the classifier backend invalidates everything cached for
+    the old models.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MEMORY_ENTRIES, max_disk_bytes=DISK_BYTES,
+                 fingerprint=model_fingerprint):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._fingerprint = fingerprint
+        self._version = None
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()  # key -> size in bytes, oldest first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.stats_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    def _version_dir(self):
+        return os.path.join(self.cache_dir, self._version)
+
+    def _check_version(self):
+        version = self._fingerprint()
+        if version == self._version:
+            return
+        if self._version is not None:
+            self.stats_counters["invalidations"] += 1
+            logging.info("Model checkpoints changed; invalidating result cache")
+        self._version = version
+        self._memory.clear()
+        self._disk.clear()
+        self._disk_bytes = 0
+
+        # Drop entries written for other model versions, index the current ones
+        os.makedirs(self._version_dir(), exist_ok=True)
+        for name in os.listdir(self.cache_dir):
+            if name != version:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+        entries = []
+        for name in os.listdir(self._version_dir()):
+            path = os.path.join(self._version_dir(), name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-len(".json")], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats_counters["memory_hits"] += 1
+                return self._memory[key]
+
+            # Other workers write to the same directory, so an unindexed key may be on disk too
+            path = os.path.join(self._version_dir(), key + ".json")
+            if key in self._disk or os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value = json.load(f)
+                        size = os.fstat(f.fileno()).st_size
+                except (OSError, ValueError):
+                    self._disk_bytes -= self._disk.pop(key, 0)
+                else:
+                    if key not in self._disk:
+                        self._disk[key] = size
+                        self._disk_bytes += size
+                    self._disk.move_to_end(key)
+                    self._remember(key, value)
+                    self.stats_counters["disk_hits"] += 1
+                    return value
+
+            self.stats_counters["misses"] += 1
+            return None
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key, value):
+        with self._lock:
+            self._check_version()
+            self._remember(key, value)
+            self.stats_counters["stores"] += 1
+
+            data = json.dumps(value).encode("utf-8")
+            try:
+                with open(os.path.join(self._version_dir(), key + ".json"), "wb") as f:
+                    f.write(data)
+            except OSError as e:
+                logging.error(f"Failed to write result cache entry: {str(e)}")
+                return
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+
+            while self._disk_bytes > self.max_disk_bytes and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                try:
+                    os.remove(os.path.join(self._version_dir(), old_key + ".json"))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.stats_counters)
+            lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+            hits = counters["memory_hits"] + counters["disk_hits"]
+            counters.update({
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "model_version": self._version,
+            })
+            return counters
+
+
+result_cache = ResultCache()
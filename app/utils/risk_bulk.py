@@ -0,0 +1,211 @@
+# app/utils/risk_bulk.py
+"""
+Bulk kidney-stone risk scoring for partner labs.
+
+Panels come in as a CSV file (header row with gravity, ph, osmo, cond, urea,
+calc and an optional id column) or a JSON array of objects with the same
+keys. Input is read and scored CHUNK_ROWS panels at a time, and results are
+streamed back as they are produced, so memory stays bounded by the chunk
+size however large the file is.
+
+    python -m app.utils.risk_bulk panels.csv -o scores.csv
+"""
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+
+from .risk_model import FEATURES, score_panels
+
+CHUNK_ROWS = int(os.environ.get("NEPHROSCAN_RISK_CHUNK_ROWS", "2048"))
+READ_SIZE = 64 * 1024
+OUTPUT_FIELDS = ["row", "id", "result", "error", "explanation"]
+
+
+class BulkInputError(ValueError):
+    pass
+
+
+def _columns(records):
+    columns = {f: [r.get(f) for r in records] for f in FEATURES}
+    ids = [r.get("id") for r in records]
+    return columns, ids
+
+
+def iter_csv_chunks(text, chunk_rows=CHUNK_ROWS):
+    """Yield (columns, ids) for each chunk of a CSV text stream."""
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None:
+        return
+    missing = [f for f in FEATURES if f not in reader.fieldnames]
+    if missing:
+        raise BulkInputError(f"CSV header is missing column(s): {', '.join(missing)}")
+    chunk = []
+    for record in reader:
+        chunk.append(record)
+        if len(chunk) == chunk_rows:
+            yield _columns(chunk)
+            chunk = []
+    if chunk:
+        yield _columns(chunk)
+
+
+def iter_json_records(text, read_size=READ_SIZE):
+    """Incrementally parse a top-level JSON array, one element at a time."""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        data = text.read(read_size)
+        if not data:
+            eof = True
+        buffer = buffer[pos:] + data
+        pos = 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip_space()
+    if pos >= len(buffer):
+        return
+    if buffer[pos] != "[":
+        raise BulkInputError("JSON input must be an array of panel objects")
+    pos += 1
+    first = True
+    while True:
+        skip_space()
+        if pos >= len(buffer):
+            raise BulkInputError("Unexpected end of JSON input")
+        if buffer[pos] == "]":
+            return
+        if not first:
+            if buffer[pos] != ",":
+                raise BulkInputError("Expected ',' between elements of the JSON array")
+            pos += 1
+            skip_space()
+        while True:
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError:
+                if eof:
+                    raise BulkInputError("Malformed JSON element in input array")
+                fill()
+        if not isinstance(record, dict):
+            raise BulkInputError("Every element of the JSON array must be an object")
+        pos = end
+        first = False
+        yield record
+
+
+def iter_json_chunks(text, chunk_rows=CHUNK_ROWS):
+    """Yield (columns, ids) for each chunk of a JSON array text stream."""
+    chunk = []
+    for record in iter_json_records(text):
+        chunk.append(record)
+        if len(chunk) == chunk_rows:
+            yield _columns(chunk)
+            chunk = []
+    if chunk:
+        yield _columns(chunk)
+
+
+def score_chunks(chunks):
+    """Score each chunk in one vectorized call and yield per-row results."""
+    row = 0
+    for columns, ids in chunks:
+        for panel_id, scored in zip(ids, score_panels(columns)):
+            row += 1
+            out = {"row": row}
+            if panel_id is not None:
+                out["id"] = panel_id
+            out.update(scored)
+            yield out
+
+
+def detect_format(filename=None, content_type=None):
+    name = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    if name.endswith(".json") or "json" in content_type:
+        return "json"
+    return None
+
+
+def score_stream(binary, input_format, chunk_rows=CHUNK_ROWS):
+    """Score a binary file-like object; yields per-row result dicts."""
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    if input_format == "csv":
+        chunks = iter_csv_chunks(text, chunk_rows)
+    elif input_format == "json":
+        chunks = iter_json_chunks(text, chunk_rows)
+    else:
+        raise BulkInputError("Input format must be 'csv' or 'json'")
+    yield from score_chunks(chunks)
+
+
+def iter_ndjson(results):
+    for r in results:
+        yield json.dumps(r) + "\n"
+
+
+def iter_csv(results):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=OUTPUT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for r in results:
+        if "explanation" in r:
+            r = dict(r, explanation=" ".join(r["explanation"]))
+        writer.writerow(r)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+def guarded(results):
+    """Turn an input error halfway through the stream into a final error row."""
+    try:
+        yield from results
+    except BulkInputError as e:
+        yield {"error": str(e)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV or JSON file of urine panels for kidney-stone risk")
+    parser.add_argument("input", help="CSV or JSON array of panels ('-' for stdin)")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "json"], help="Input format (default: from the file extension)")
+    parser.add_argument("--output-format", choices=["csv", "ndjson"], help="Output format (default: same as input)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    input_format = args.format or detect_format(args.input)
+    if input_format is None:
+        parser.error("cannot tell the input format from the file name; pass --format")
+    output_format = args.output_format or ("csv" if input_format == "csv" else "ndjson")
+
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    sink = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    writer = iter_csv if output_format == "csv" else iter_ndjson
+    try:
+        for piece in writer(guarded(score_stream(source, input_format, args.chunk_rows))):
+            sink.write(piece)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,139 @@
 # app/utils/risk_model.py
 
-import joblib
 import numpy as np
+from .model_registry import registry
+from .metrics import span
 
-# Load model and scaler once
-model = joblib.load("models/kidney_stone_rf_model.joblib")
-scaler = joblib.load("models/kidney_stone_scaler.joblib")
+# Model input order, user-friendly names for error messages and the accepted
+# ranges (based on dataset ranges; kept as text so messages match the quiz)
+FEATURES = ['gravity', 'ph', 'osmo', 'cond', 'urea', 'calc']
+FEATURE_NAMES = {
+    'gravity': 'Urine Density',
+    'ph': 'Urine Acidity',
+    'osmo': 'Urine Concentration',
+    'cond': 'Urine Conductivity',
+    'urea': 'Urea Level',
+    'calc': 'Calcium Level'
+}
+FEATURE_RANGES = {
+    'gravity': ('1.005', '1.030'),
+    'ph': ('4.5', '8.0'),
+    'osmo': ('200', '1200'),
+    'cond': ('5', '40'),
+    'urea': ('50', '500'),
+    'calc': ('1', '10')
+}
+_LOW = np.array([float(FEATURE_RANGES[f][0]) for f in FEATURES])
+_HIGH = np.array([float(FEATURE_RANGES[f][1]) for f in FEATURES])
 
-def predict_kidney_risk(form_data):
+
+def random_panels(n, seed=0):
+    """Random urine panels inside the accepted ranges, as a float (n, 6) matrix."""
+    return np.random.default_rng(seed).uniform(_LOW, _HIGH, size=(n, len(FEATURES)))
+
+
+def validate_panels(columns):
     """
-    Predict kidney stone risk based on urine analysis inputs.
-    Expects form_data with keys: gravity, ph, osmo, cond, urea, calc.
-    Returns 'Kidney Stone' or 'No Kidney Stone' with explanation.
+    Vectorized validation of a chunk of panels.
+    `columns` maps each feature to an array-like of raw values (strings,
+    numbers or None). Returns (values, errors): a float (n, 6) matrix and a
+    list holding None for valid rows or the message for the first bad field,
+    in the same order the quiz checks them.
     """
-    # Define expected features and their aliases for user-friendly error messages
-    features = {
-        'gravity': 'Urine Density',
-        'ph': 'Urine Acidity',
-        'osmo': 'Urine Concentration',
-        'cond': 'Urine Conductivity',
-        'urea': 'Urea Level',
-        'calc': 'Calcium Level'
-    }
-    
-    # Validate and collect inputs
-    input_values = []
-    for feature in ['gravity', 'ph', 'osmo', 'cond', 'urea', 'calc']:
-        value = form_data.get(feature)
-        if value is None or value == "":
-            raise ValueError(f"Please enter a value for {features[feature]}")
-        try:
-            value = float(value)
-        except ValueError:
-            raise ValueError(f"{features[feature]} must be a number")
-        
-        # Basic range validation (based on dataset ranges)
-        if feature == 'gravity' and not (1.005 <= value <= 1.030):
-            raise ValueError(f"{features[feature]} should be between 1.005 and 1.030")
-        elif feature == 'ph' and not (4.5 <= value <= 8.0):
-            raise ValueError(f"{features[feature]} should be between 4.5 and 8.0")
-        elif feature == 'osmo' and not (200 <= value <= 1200):
-            raise ValueError(f"{features[feature]} should be between 200 and 1200")
-        elif feature == 'cond' and not (5 <= value <= 40):
-            raise ValueError(f"{features[feature]} should be between 5 and 40")
-        elif feature == 'urea' and not (50 <= value <= 500):
-            raise ValueError(f"{features[feature]} should be between 50 and 500")
-        elif feature == 'calc' and not (1 <= value <= 10):
-            raise ValueError(f"{features[feature]} should be between 1 and 10")
-        
-        input_values.append(value)
-    
-    # Prepare input for model
-    input_array = np.array([input_values])
-    input_scaled = scaler.transform(input_array)
-    
-    # Predict
-    prediction = model.predict(input_scaled)
-    result = 'Kidney Stone' if prediction[0] == 1 else 'No Kidney Stone'
-    
-    # Generate user-friendly explanation
+    n = max((len(v) for v in columns.values()), default=0)
+    raw = np.empty((n, len(FEATURES)), dtype=object)
+    for j, feature in enumerate(FEATURES):
+        raw[:, j] = columns.get(feature, [None] * n)
+    missing = (raw == None) | (raw == "")  # noqa: E711, elementwise on object arrays
+    values = _to_float(np.where(missing, "nan", raw))
+    not_number = ~missing & np.isnan(values)
+    out_of_range = ~missing & ~not_number & ((values < _LOW) | (values > _HIGH))
+
+    errors = [None] * len(values)
+    bad = missing | not_number | out_of_range
+    for i in np.flatnonzero(bad.any(axis=1)):
+        j = int(np.argmax(bad[i]))
+        name = FEATURE_NAMES[FEATURES[j]]
+        if missing[i, j]:
+            errors[i] = f"Please enter a value for {name}"
+        elif not_number[i, j]:
+            errors[i] = f"{name} must be a number"
+        else:
+            low, high = FEATURE_RANGES[FEATURES[j]]
+            errors[i] = f"{name} should be between {low} and {high}"
+    return values, errors
+
+
+def _to_float(raw):
+    """Parse a whole object matrix at once; unparseable cells become NaN."""
+    try:
+        return raw.astype(np.float64)
+    except (TypeError, ValueError):
+        # Rare slow path: at least one cell is not a number
+        out = np.full(raw.shape, np.nan)
+        for idx, value in np.ndenumerate(raw):
+            try:
+                out[idx] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+
+def explain(is_stone, values):
+    """User-friendly explanation for one scored panel (values in FEATURES order)."""
     explanation = []
-    if result == 'Kidney Stone':
+    if is_stone:
         explanation.append("The urine test suggests you may have a kidney stone.")
         explanation.append("Possible reasons (common in India):")
-        if input_values[0] > 1.020:  # High gravity
+        if values[0] > 1.020:  # High gravity
             explanation.append("- Low water intake, especially in hot weather")
-        if input_values[1] < 6.0:  # Low pH
+        if values[1] < 6.0:  # Low pH
             explanation.append("- Diet high in acidic foods (e.g., tea, spinach)")
-        if input_values[5] > 5.0:  # High calcium
+        if values[5] > 5.0:  # High calcium
             explanation.append("- High intake of oxalate-rich foods (e.g., nuts, tea)")
         explanation.append("Please see a doctor for tests and advice (e.g., drink more water, reduce oxalate foods).")
     else:
         explanation.append("The urine test suggests you are unlikely to have a kidney stone.")
         explanation.append("To stay safe, drink plenty of water and eat a balanced diet.")
-    
-    return result, explanation
+    return explanation
+
+
+def score_panels(columns):
+    """
+    Validate and score a chunk of panels with one predict call over all
+    valid rows. Returns one dict per input row with either
+    result/explanation or error.
+    """
+    with span("risk.validate"):
+        values, errors = validate_panels(columns)
+        valid = np.array([e is None for e in errors], dtype=bool)
+
+    predictions = np.zeros(len(errors), dtype=np.int64)
+    if valid.any():
+        # Compiled forest (sklearn for bulk batches) or the sklearn scaler + model pair
+        with span("risk.predict"):
+            predictions[valid] = registry.get("risk_predictor").predict(values[valid])
+
+    rows = []
+    for i, error in enumerate(errors):
+        if error is not None:
+            rows.append({"error": error})
+            continue
+        is_stone = predictions[i] == 1
+        rows.append({
+            "result": 'Kidney Stone' if is_stone else 'No Kidney Stone',
+            "explanation": explain(is_stone, values[i]),
+        })
+    return rows
+
+
+def predict_kidney_risk(form_data):
+    """
+    Predict kidney stone risk based on urine analysis inputs.
+    Expects form_data with keys: gravity, ph, osmo, cond, urea, calc.
+    Returns 'Kidney Stone' or 'No Kidney Stone' with explanation.
+    """
+    row = score_panels({f: [form_data.get(f)] for f in FEATURES})[0]
+    if "error" in row:
+        raise ValueError(row["error"])
+    return row["result"], row["explanation"]
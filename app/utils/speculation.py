@@ -0,0 +1,104 @@
+# app/utils/speculation.py
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .localization import localize_kidney
+
+SPECULATIVE_ENABLED = os.environ.get("NEPHROSCAN_SPECULATIVE_LOCALIZATION", "1") == "1"
+SPECULATIVE_WORKERS = int(os.environ.get("NEPHROSCAN_SPECULATIVE_WORKERS", "2"))
+# Stop speculating while the expected share of discarded YOLO runs
+# (i.e. the recent rate of "normal" scans) is above this value
+MAX_DISCARD_RATE = float(os.environ.get("NEPHROSCAN_SPECULATIVE_MAX_DISCARD", "0.5"))
+EWMA_ALPHA = 0.05
+
+
+def _timed_localize(image, annotate):
+    start = time.perf_counter()
+    boxes, localized_image = localize_kidney(image, annotate=annotate)
+    return boxes, localized_image, time.perf_counter() - start
+
+
+class SpeculativeLocalizer:
+    """
+    Starts YOLO localization in parallel with classification, on the bet that
+    the scan is abnormal. When the classifier says "normal" the YOLO run is
+    cancelled if it has not started yet, otherwise its result is discarded.
+    """
+
+    def __init__(self, enabled=SPECULATIVE_ENABLED, workers=SPECULATIVE_WORKERS,
+                 max_discard_rate=MAX_DISCARD_RATE):
+        self.enabled = enabled
+        self.max_discard_rate = max_discard_rate
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculative-yolo")
+        self._lock = threading.Lock()
+        self._normal_rate = 0.0
+        self.counters = {
+            "launched": 0,
+            "used": 0,
+            "cancelled": 0,
+            "discarded": 0,
+            "skipped": 0,
+            "saved_seconds": 0.0,
+            "wasted_seconds": 0.0,
+        }
+
+    def should_speculate(self):
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._normal_rate > self.max_discard_rate:
+                self.counters["skipped"] += 1
+                return False
+            return True
+
+    def start(self, image, annotate=True):
+        with self._lock:
+            self.counters["launched"] += 1
+        return self._executor.submit(_timed_localize, image, annotate)
+
+    def observe(self, label):
+        # Track the recent share of normal scans for every request, so
+        # speculation resumes once abnormal scans dominate again
+        with self._lock:
+            is_normal = 1.0 if label == "normal" else 0.0
+            self._normal_rate += EWMA_ALPHA * (is_normal - self._normal_rate)
+
+    def collect(self, future, classify_seconds, started_at):
+        boxes, localized_image, localize_seconds = future.result()
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.counters["used"] += 1
+            # Sequential execution would have cost classify + localize
+            self.counters["saved_seconds"] += max(0.0, classify_seconds + localize_seconds - elapsed)
+        return boxes, localized_image
+
+    def discard(self, future):
+        if future.cancel():
+            with self._lock:
+                self.counters["cancelled"] += 1
+            return
+        future.add_done_callback(self._record_waste)
+
+    def _record_waste(self, future):
+        with self._lock:
+            self.counters["discarded"] += 1
+            if future.exception() is None:
+                self.counters["wasted_seconds"] += future.result()[2]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            launched = stats["launched"]
+            stats.update({
+                "enabled": self.enabled,
+                "max_discard_rate": self.max_discard_rate,
+                "recent_normal_rate": round(self._normal_rate, 4),
+                "discard_rate": round((stats["cancelled"] + stats["discarded"]) / launched, 4) if launched else 0.0,
+                "mean_saved_ms": round(1000.0 * stats["saved_seconds"] / stats["used"], 2) if stats["used"] else 0.0,
+            })
+            return stats
+
+
+speculative_localizer = SpeculativeLocalizer()
@@ -0,0 +1,218 @@
+# app/utils/spelling.py
+"""
+Symmetric-delete (SymSpell-style) spelling correction for chat messages.
+
+The dictionary is a general English word list (rag/english_words.txt), so
+everyday words are known and left alone, plus the domain vocabulary from
+rag/index_documents.txt and rag/medical_lexicon.txt, so nephrology terms are
+never "corrected" into common English. A misspelling is corrected to the
+closest word, preferring a domain term over an English word at the same
+distance. Acronyms and other words in all caps or with inner capitals
+(CKD, eGFR, HbA1c) are left as typed. The delete index is precomputed and
+pickled under cache/ (it is not checked in); it is built on first load and
+rebuilt automatically when the sources change:
+
+    python -m app.utils.spelling --build
+"""
+import os
+import re
+import pickle
+import hashlib
+import argparse
+from collections import Counter
+from functools import lru_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAG_DIR = os.path.join(BASE_DIR, "../../rag/")
+CORPUS_PATH = os.path.join(RAG_DIR, "index_documents.txt")
+LEXICON_PATH = os.path.join(RAG_DIR, "medical_lexicon.txt")
+ENGLISH_PATH = os.path.join(RAG_DIR, "english_words.txt")
+INDEX_PATH = os.environ.get("NEPHROSCAN_SPELL_INDEX", os.path.join("cache", "symspell_index.pkl"))
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_WORD_LENGTH = 3
+INDEX_FORMAT = 2
+
+WORD_RE = re.compile(r"[A-Za-z]+")
+
+
+def _edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 once exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = cur[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+            row_min = min(row_min, cur[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= max_distance else max_distance + 1
+
+
+def _deletes(word, max_distance, prefix_length):
+    word = word[:prefix_length]
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        nxt = set()
+        for w in frontier:
+            if len(w) <= 1:
+                continue
+            for i in range(len(w)):
+                nxt.add(w[:i] + w[i + 1:])
+        nxt -= found
+        found |= nxt
+        frontier = nxt
+    return found
+
+
+def _source_hash(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _read_weighted_words(path, default_weight):
+    counts = Counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            weight = int(parts[1]) if len(parts) > 1 else default_weight
+            counts[parts[0].lower()] += weight
+    return counts
+
+
+def load_word_counts(corpus_path=CORPUS_PATH, lexicon_path=LEXICON_PATH):
+    """Domain vocabulary: words of the RAG corpus plus the weighted lexicon."""
+    counts = Counter()
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        for line in f:
+            counts.update(w.lower() for w in WORD_RE.findall(line))
+    counts.update(_read_weighted_words(lexicon_path, 50))
+    return counts
+
+
+def load_english_counts(english_path=ENGLISH_PATH):
+    return _read_weighted_words(english_path, 1)
+
+
+class SymSpell:
+    def __init__(self, words, deletes, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH, domain=()):
+        # words: list of (word, count); deletes: delete-string -> tuple of word indices;
+        # domain: words preferred over other candidates at the same edit distance
+        self.words = words
+        self.counts = dict(words)
+        self.deletes = deletes
+        self.domain = frozenset(domain)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.lookup = lru_cache(maxsize=8192)(self._lookup)
+
+    @classmethod
+    def build(cls, counts, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH, base_counts=None):
+        """counts: domain vocabulary; base_counts: general words that are known but not preferred."""
+        merged = Counter(base_counts or {})
+        merged.update(counts)
+        words = sorted(merged.items(), key=lambda kv: (-kv[1], kv[0]))
+        deletes = {}
+        for idx, (word, _) in enumerate(words):
+            for d in _deletes(word, max_distance, prefix_length):
+                deletes.setdefault(d, []).append(idx)
+        return cls(words, {k: tuple(v) for k, v in deletes.items()}, max_distance, prefix_length, counts)
+
+    def _lookup(self, token):
+        """Best correction for a lowercase token, or the token itself."""
+        if token in self.counts or len(token) < MIN_WORD_LENGTH:
+            return token
+        # Short words get a tighter bound so they are not rewritten wholesale
+        max_distance = 1 if len(token) <= 4 else self.max_distance
+
+        # Rank by distance, then domain terms first, then frequency
+        best, best_rank = token, (max_distance + 1,)
+        seen = set()
+        for d in _deletes(token, max_distance, self.prefix_length):
+            for idx in self.deletes.get(d, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                word, count = self.words[idx]
+                distance = _edit_distance(token, word, max_distance)
+                if distance > max_distance:
+                    continue
+                rank = (distance, word not in self.domain, -count)
+                if rank < best_rank:
+                    best, best_rank = word, rank
+        return best
+
+    def correct(self, text):
+        def fix(match):
+            word = match.group(0)
+            # Acronyms and mixed-case terms (CKD, eGFR, HbA1c) are left as typed
+            if not word[1:].islower():
+                return word
+            corrected = self.lookup(word.lower())
+            if corrected == word.lower():
+                return word
+            # Only lowercase and capitalized words get here; keep that casing
+            return corrected.capitalize() if word[0].isupper() else corrected
+        return WORD_RE.sub(fix, text)
+
+
+def build_index(path=INDEX_PATH, corpus_path=CORPUS_PATH, lexicon_path=LEXICON_PATH, english_path=ENGLISH_PATH):
+    checker = SymSpell.build(load_word_counts(corpus_path, lexicon_path),
+                             base_counts=load_english_counts(english_path))
+    data = {
+        "format": INDEX_FORMAT,
+        "source_hash": _source_hash([corpus_path, lexicon_path, english_path]),
+        "max_distance": checker.max_distance,
+        "prefix_length": checker.prefix_length,
+        "words": checker.words,
+        "deletes": checker.deletes,
+        "domain": sorted(checker.domain),
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Workers may build it at the same time; each writes its own file and renames it in
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return checker
+
+
+def load_spell_checker(path=INDEX_PATH, corpus_path=CORPUS_PATH, lexicon_path=LEXICON_PATH, english_path=ENGLISH_PATH):
+    """Load the precomputed index, rebuilding it if missing or stale."""
+    sources = [corpus_path, lexicon_path, english_path]
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("format") == INDEX_FORMAT and data["source_hash"] == _source_hash(sources):
+            return SymSpell(data["words"], data["deletes"], data["max_distance"], data["prefix_length"],
+                            data["domain"])
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+    return build_index(path, corpus_path, lexicon_path, english_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the chat spelling-correction index")
+    parser.add_argument("--build", action="store_true", help=f"Rebuild {INDEX_PATH}")
+    parser.add_argument("text", nargs="*", help="Text to correct")
+    args = parser.parse_args()
+    checker = build_index() if args.build else load_spell_checker()
+    print(f"{len(checker.words)} words, {len(checker.deletes)} delete entries")
+    if args.text:
+        print(checker.correct(" ".join(args.text)))
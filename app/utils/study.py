@@ -0,0 +1,121 @@
+# app/utils/study.py
+import os
+import heapq
+import zipfile
+import logging
+
+from .batching import classifier_service
+from .model_registry import CLASS_LABELS
+from .imaging import decode_image, to_classifier_tensor
+from .localization import localize_kidney
+
+STUDY_BATCH_SIZE = int(os.environ.get("NEPHROSCAN_STUDY_BATCH_SIZE", "16"))
+MAX_KEY_SLICES = int(os.environ.get("NEPHROSCAN_STUDY_KEY_SLICES", "5"))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+def iter_study_slices(files):
+    """
+    Yield (slice_name, raw_bytes) one slice at a time from a list of uploaded
+    files. Zip archives are read member by member, so only one compressed
+    slice is held in memory at once.
+    """
+    for f in files:
+        if not f or not f.filename:
+            continue
+        if f.filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(f.stream) as archive:
+                members = sorted(
+                    (i for i in archive.infolist()
+                     if not i.is_dir() and i.filename.lower().endswith(IMAGE_EXTENSIONS)),
+                    key=lambda i: i.filename
+                )
+                for info in members:
+                    yield info.filename, archive.read(info)
+        elif f.filename.lower().endswith(IMAGE_EXTENSIONS):
+            yield f.filename, f.read()
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def analyze_study(slices, batch_size=STUDY_BATCH_SIZE, key_slices=MAX_KEY_SLICES):
+    """
+    Stream slices through the classifier in batches and localize only the
+    slices flagged abnormal. Only running counts and a top-k heap per label
+    are kept, so memory is bounded by batch_size regardless of study size.
+    """
+    label_counts = {label: 0 for label in CLASS_LABELS}
+    label_confidence = {label: 0.0 for label in CLASS_LABELS}
+    top_slices = {label: [] for label in CLASS_LABELS}
+    total_boxes = 0
+    num_slices = 0
+    skipped = []
+
+    for batch in _batched(slices, batch_size):
+        decoded = []
+        for name, data in batch:
+            try:
+                decoded.append((name, decode_image(data)))
+            except Exception as e:
+                logging.error(f"Skipping unreadable slice {name}: {str(e)}")
+                skipped.append(name)
+
+        # Submit the whole chunk so the batcher can run it as one forward pass
+        futures = [(name, image, classifier_service.submit(to_classifier_tensor(image)))
+                   for name, image in decoded]
+
+        for name, image, future in futures:
+            label, probabilities = future.result()
+            confidence = probabilities[label]
+            num_slices += 1
+            label_counts[label] += 1
+            label_confidence[label] += confidence
+
+            boxes = []
+            if label != "normal":
+                boxes, _ = localize_kidney(image, annotate=False)
+                total_boxes += len(boxes)
+
+            entry = (confidence, num_slices, {
+                "slice": name,
+                "index": num_slices - 1,
+                "label": label,
+                "confidence": round(confidence, 4),
+                "boxes": boxes,
+            })
+            heap = top_slices[label]
+            if len(heap) < key_slices:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+        del decoded, futures
+
+    # Study verdict: the abnormal label seen on most slices (ties broken by
+    # summed confidence); normal only when no slice is abnormal
+    abnormal = [label for label in CLASS_LABELS if label != "normal" and label_counts[label] > 0]
+    if abnormal:
+        verdict = max(abnormal, key=lambda l: (label_counts[l], label_confidence[l]))
+    else:
+        verdict = "normal"
+
+    key = [entry for _, _, entry in sorted(top_slices[verdict], reverse=True)]
+
+    return {
+        "verdict": verdict,
+        "num_slices": num_slices,
+        "label_counts": label_counts,
+        "abnormal_slices": sum(label_counts[l] for l in abnormal),
+        "total_boxes": total_boxes,
+        "key_slices": key,
+        "skipped_slices": skipped,
+    }
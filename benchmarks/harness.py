@@ -0,0 +1,204 @@
+# benchmarks/harness.py
+"""
+Shared pieces of the benchmark suite: latency summaries, peak RSS, JSON
+reports and comparison against a stored baseline.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+# Machine-local paths; they would make a committed baseline differ per checkout
+LOCAL_ARGS = ("workdir", "output", "baseline")
+PACKAGES = ("torch", "torchvision", "numpy", "scikit-learn", "ultralytics", "faiss-cpu",
+            "sentence-transformers", "Flask", "gunicorn")
+
+
+def summarize(latencies, wall_seconds=None, errors=0):
+    """p50/p95/p99 in ms; throughput is completed calls per wall-clock second."""
+    ms = np.asarray(latencies, dtype=np.float64) * 1000.0
+    summary = {
+        "count": int(ms.size),
+        "errors": int(errors),
+        "mean_ms": round(float(ms.mean()), 3) if ms.size else None,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3) if ms.size else None,
+        "p95_ms": round(float(np.percentile(ms, 95)), 3) if ms.size else None,
+        "p99_ms": round(float(np.percentile(ms, 99)), 3) if ms.size else None,
+        "max_ms": round(float(ms.max()), 3) if ms.size else None,
+    }
+    wall = wall_seconds if wall_seconds is not None else float(ms.sum()) / 1000.0
+    summary["throughput_per_s"] = round(ms.size / wall, 2) if wall > 0 else None
+    return summary
+
+
+def time_calls(fn, repeat, warmup=3):
+    """Call fn() `repeat` times (after `warmup` untimed calls) and summarize."""
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(warmup + i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0, 1)
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def _memory_gb():
+    try:
+        return round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3, 1)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _package_versions():
+    from importlib import metadata
+
+    versions = {}
+    for name in PACKAGES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def environment(args):
+    """Where a report was produced: code, interpreter, hardware and package versions."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "memory_gb": _memory_gb(),
+        "packages": _package_versions(),
+        "args": {k: v for k, v in vars(args).items() if k not in LOCAL_ARGS},
+    }
+
+
+def write_report(suite, results, args, output=None):
+    report = {"suite": suite, "environment": environment(args), "peak_rss_mb": peak_rss_mb(), "results": results}
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output} (peak RSS {report['peak_rss_mb']} MB)")
+    return report
+
+
+def save_baseline(suite, report, path=None):
+    path = path or os.path.join(BASELINE_DIR, f"{suite}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+def compare(suite, report, path=None, tolerance=0.15):
+    """
+    Print each case against the baseline. A case regresses when its p95 is
+    more than `tolerance` above the baseline's or its throughput is that
+    much lower. Returns the list of regressed cases.
+    """
+    path = path or os.path.join(BASELINE_DIR, f"{suite}.json")
+    if not os.path.exists(path):
+        print(f"No baseline at {path}; run with --save-baseline to create one")
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    # Timings only compare on the same hardware and stack
+    base_env, env = baseline.get("environment", {}), report["environment"]
+    for key in ("cpu_model", "cpu_count", "packages"):
+        if base_env.get(key) != env.get(key):
+            print(f"warning: baseline {key} differs: {base_env.get(key)} (baseline) vs {env.get(key)}")
+
+    regressions = []
+    print(f"{'case':<34}{'p95 ms':>12}{'baseline':>12}{'change':>10}{'thr/s':>10}{'baseline':>10}")
+    for name, current in report["results"].items():
+        base = baseline["results"].get(name)
+        if not base or not current.get("p95_ms") or not base.get("p95_ms"):
+            print(f"{name:<34}{current.get('p95_ms') or '-':>12}{'-':>12}")
+            continue
+        change = current["p95_ms"] / base["p95_ms"] - 1.0
+        slower = change > tolerance
+        thr, base_thr = current.get("throughput_per_s"), base.get("throughput_per_s")
+        fewer = bool(thr and base_thr and thr < base_thr * (1.0 - tolerance))
+        flag = "  REGRESSION" if slower or fewer else ""
+        print(f"{name:<34}{current['p95_ms']:>12.3f}{base['p95_ms']:>12.3f}{change * 100:>9.1f}%"
+              f"{thr or '-':>10}{base_thr or '-':>10}{flag}")
+        if flag:
+            regressions.append(name)
+
+    rss, base_rss = report.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if rss and base_rss:
+        print(f"peak RSS {rss} MB (baseline {base_rss} MB)")
+        if rss > base_rss * (1.0 + tolerance):
+            regressions.append("peak_rss_mb")
+    return regressions
+
+
+def add_common_arguments(parser):
+    parser.add_argument("--real-models", action="store_true", help="Use the real checkpoints instead of stand-ins")
+    parser.add_argument("--workdir", default=os.path.join(BENCH_DIR, ".workdir"),
+                        help="Where static/ and cache/ outputs go with stand-in models")
+    parser.add_argument("--output", help="Report path (default: benchmarks/results/<suite>_<time>.json)")
+    parser.add_argument("--baseline", help="Baseline JSON (default: benchmarks/baselines/<suite>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed p95/throughput/RSS change")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression")
+
+
+def prepare(args):
+    """Resolve output paths, then (for stand-ins) move into the scratch workdir before `app` is imported."""
+    import standins
+
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    if not args.real_models:
+        standins.configure_environment(args.workdir)
+
+
+def finish(suite, results, args):
+    report = write_report(suite, results, args, args.output)
+    if args.save_baseline:
+        save_baseline(suite, report, args.baseline)
+        return
+    regressions = compare(suite, report, args.baseline, args.tolerance)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,148 @@
+# benchmarks/load_test.py
+"""
+Load test for the user-facing routes: POST / (scan upload), POST /chat and
+POST /risk-quiz, each driven by --concurrency client threads.
+
+By default the app runs in-process through Flask's test client with
+stand-in models (see standins.py), so the run is offline and peak RSS is
+the server's. With --url the same traffic goes to a running server, and
+RSS is only that of the load generator.
+
+    python benchmarks/load_test.py [--concurrency 8] [--requests 200] [--route chat]
+    python benchmarks/load_test.py --url http://127.0.0.1:5000
+
+Every upload is a distinct synthetic scan, drawn from a fresh seed on each
+run (--seed repeats one), so neither warm-up nor an earlier run leaves it in
+the result cache.
+Results go to benchmarks/results/ and are compared against
+benchmarks/baselines/load.json.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harness
+import standins
+
+ROUTES = ("upload", "chat", "risk_quiz")
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def upload(self, png, name):
+        r = self._client.post("/", data={"image": (io.BytesIO(png), name)}, content_type="multipart/form-data")
+        return r.status_code
+
+    def post_form(self, path, data):
+        return self._client.post(path, data=data).status_code
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        import requests
+
+        self._session = requests.Session()
+        self._base = base_url.rstrip("/")
+
+    def upload(self, png, name):
+        r = self._session.post(self._base + "/", files={"image": (name, png, "image/png")}, allow_redirects=False)
+        return r.status_code
+
+    def post_form(self, path, data):
+        return self._session.post(self._base + path, data=data, allow_redirects=False).status_code
+
+
+def build_requests(route, n, seed):
+    """Payloads are prepared up front so their cost is not timed."""
+    if route == "upload":
+        return [(f"scan_{seed + i}.png", standins.synthetic_upload(seed=seed + i)) for i in range(n)]
+    if route == "chat":
+        questions = standins.CHAT_QUESTIONS
+        return [{"message": questions[i % len(questions)]} for i in range(n)]
+    panels = standins.synthetic_panels(n, seed=3)
+    return [standins.panel_form(p) for p in panels]
+
+
+def drive(route, payloads, concurrency, make_client):
+    local = threading.local()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(payload):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = make_client()
+        start = time.perf_counter()
+        try:
+            if route == "upload":
+                status = client.upload(payload[1], payload[0])
+            else:
+                status = client.post_form("/chat" if route == "chat" else "/risk-quiz", payload)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - start
+        with lock:
+            if status is None or status >= 400:
+                errors.append(status)
+            else:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, payloads))
+    return harness.summarize(latencies, time.perf_counter() - start, errors=len(errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test NephroScan's upload, chat and risk-quiz routes")
+    parser.add_argument("--url", help="Drive a running server instead of the in-process app")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route (uploads: a quarter of this)")
+    parser.add_argument("--route", action="append", choices=ROUTES, help="Route(s) to drive (default: all)")
+    parser.add_argument("--seed", type=int, help="First synthetic scan seed (default: new each run)")
+    harness.add_common_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = int(time.time() * 1000) % 1_000_000_000
+    if args.url:
+        args.real_models = True  # nothing to stub in this process
+
+    harness.prepare(args)
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        from app.main import create_app
+        from app.utils.model_registry import registry
+
+        if args.real_models:
+            registry.load_all()
+        else:
+            standins.install()
+        app = create_app()
+        make_client = lambda: InProcessClient(app)
+
+    results = {}
+    for route in args.route or ROUTES:
+        n = max(1, args.requests // 4) if route == "upload" else args.requests
+        # The first `concurrency` payloads only warm up, so no timed upload repeats one
+        payloads = build_requests(route, n + args.concurrency, args.seed)
+        drive(route, payloads[:args.concurrency], args.concurrency, make_client)
+        payloads = payloads[args.concurrency:]
+        name = f"{route}_c{args.concurrency}"
+        results[name] = r = drive(route, payloads, args.concurrency, make_client)
+        print(f"{name:<20} p50 {r['p50_ms'] or 0:>9.1f} ms  p95 {r['p95_ms'] or 0:>9.1f} ms  "
+              f"p99 {r['p99_ms'] or 0:>9.1f} ms  {r['throughput_per_s']} req/s  errors {r['errors']}")
+
+    harness.finish("load", results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/micro_benchmark.py
+"""
+Micro-benchmarks for the model-facing functions, on synthetic inputs and
+stand-in models (see standins.py):
+
+    classifier forward (batch 1 and 8), localize_kidney (boxes only and
+    annotated), map_coordinates_to_regions, retrieve_context (cold and
+    cached), correct_spelling, predict_kidney_risk
+
+    python benchmarks/micro_benchmark.py [--repeat 50] [--save-baseline]
+
+Results (p50/p95/p99, throughput, peak RSS) go to benchmarks/results/ and
+are compared against benchmarks/baselines/micro.json.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harness
+import standins
+
+
+def run(args):
+    import torch
+    from app.utils.model_registry import registry
+    from app.utils.imaging import to_classifier_tensor
+    from app.utils.localization import localize_kidney, map_coordinates_to_regions
+    from app.utils.chatbot import retrieve_context, correct_spelling, embedding_cache, retrieval_cache
+    from app.utils.risk_model import predict_kidney_risk
+
+    if not args.real_models:
+        standins.install()
+    else:
+        registry.load_all()
+
+    scans = [standins.synthetic_scan(seed) for seed in range(8)]
+    tensors = [to_classifier_tensor(scan) for scan in scans]
+    panels = standins.synthetic_panels(256, seed=2)
+    questions = standins.CHAT_QUESTIONS
+    classifier = registry.get("classifier")
+    repeat = args.repeat
+
+    def classify(batch_size):
+        batch = torch.stack(tensors[:batch_size])
+
+        def call(i):
+            with torch.no_grad():
+                classifier(batch)
+        return call
+
+    def retrieve_cold(i):
+        embedding_cache.clear()
+        retrieval_cache.clear()
+        retrieve_context(questions[i % len(questions)])
+
+    cases = {
+        "classifier_forward_b1": (classify(1), repeat),
+        "classifier_forward_b8": (classify(8), max(1, repeat // 4)),
+        "localize_kidney_boxes": (lambda i: localize_kidney(scans[i % len(scans)], annotate=False), repeat),
+        "localize_kidney_annotated": (lambda i: localize_kidney(scans[i % len(scans)], annotate=True), repeat),
+        "map_coordinates_to_regions": (
+            lambda i: map_coordinates_to_regions([[40, 60, 120, 160], [300, 200, 380, 290], [200, 220, 260, 300]]),
+            repeat * 100),
+        "retrieve_context_cold": (retrieve_cold, repeat),
+        "retrieve_context_cached": (lambda i: retrieve_context(questions[i % len(questions)]), repeat * 10),
+        "correct_spelling": (lambda i: correct_spelling(f"what causes kidny stnes {i}"), repeat * 10),
+        "predict_kidney_risk": (lambda i: predict_kidney_risk(standins.panel_form(panels[i % len(panels)])), repeat * 10),
+    }
+
+    results = {}
+    for name, (fn, n) in cases.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = harness.time_calls(fn, n)
+        r = results[name]
+        print(f"{name:<30} p50 {r['p50_ms']:>9.3f} ms  p95 {r['p95_ms']:>9.3f} ms  "
+              f"p99 {r['p99_ms']:>9.3f} ms  {r['throughput_per_s']:>10} /s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for NephroScan's models and helpers")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per case (cheap cases run more)")
+    parser.add_argument("--only", action="append", help="Run only this case (repeatable)")
+    harness.add_common_arguments(parser)
+    args = parser.parse_args()
+
+    harness.prepare(args)
+    harness.finish("micro", run(args), args)
+
+
+if __name__ == "__main__":
+    main()
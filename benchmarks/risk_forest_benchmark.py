@@ -0,0 +1,66 @@
+# benchmarks/risk_forest_benchmark.py
+"""
+Latency of the kidney-stone risk model: sklearn (scaler.transform +
+forest.predict) vs. the compiled structure-of-arrays forest, and the routed
+predictor the server uses (compiled up to NEPHROSCAN_COMPILED_MAX_ROWS rows,
+sklearn above), for a single /risk-quiz row and for a 100k-row bulk batch.
+
+    python benchmarks/risk_forest_benchmark.py [--rows 100000] [--repeat 200]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.utils.compiled_forest import RoutedRiskPredictor, SklearnRiskPredictor, compile_forest
+from app.utils.model_registry import RISK_MODEL_PATH, RISK_SCALER_PATH
+from standins import synthetic_panels
+
+
+def time_ms(fn, repeat):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(1000.0 * (time.perf_counter() - start))
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled risk forest against sklearn")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=200, help="Repeats for the single-row case")
+    parser.add_argument("--bulk-repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model = joblib.load(RISK_MODEL_PATH)
+    scaler = joblib.load(RISK_SCALER_PATH)
+    forest = compile_forest(model, scaler)
+    routed = RoutedRiskPredictor(forest, SklearnRiskPredictor(model, scaler))
+    print(f"{forest.meta['n_trees']} trees, {forest.meta['n_nodes']} nodes, max depth {forest.depth}")
+
+    one = synthetic_panels(1)
+    bulk = synthetic_panels(args.rows, seed=1)
+    agreement = float(np.mean(forest.predict(bulk) == model.predict(scaler.transform(bulk))))
+
+    cases = [("1 row", one, args.repeat), (f"{args.rows} rows", bulk, args.bulk_repeat)]
+    print(f"{'case':<14}{'path':<10}{'median ms':>12}{'max ms':>12}")
+    for name, X, repeat in cases:
+        sk_median, sk_max = time_ms(lambda: model.predict(scaler.transform(X)), repeat)
+        c_median, c_max = time_ms(lambda: forest.predict(X), repeat)
+        r_median, r_max = time_ms(lambda: routed.predict(X), repeat)
+        print(f"{name:<14}{'sklearn':<10}{sk_median:>12.3f}{sk_max:>12.3f}")
+        print(f"{name:<14}{'compiled':<10}{c_median:>12.3f}{c_max:>12.3f}   ({sk_median / c_median:.1f}x)")
+        print(f"{name:<14}{'routed':<10}{r_median:>12.3f}{r_max:>12.3f}   ({sk_median / r_median:.1f}x)")
+    print(f"Agreement with sklearn on {args.rows} random panels: {agreement:.5f}")
+
+
+if __name__ == "__main__":
+    main()
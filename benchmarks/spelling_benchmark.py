@@ -0,0 +1,125 @@
+# benchmarks/spelling_benchmark.py
+"""
+Latency and accuracy of the chat spelling corrector on kidney terminology
+on everyday, non-medical phrasing that must come through unchanged, and
+on casing (acronyms such as eGFR are kept as typed, capitals are preserved):
+precomputed symmetric-delete index vs. the previous TextBlob path.
+
+    python benchmarks/spelling_benchmark.py [--repeat 20]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.utils.spelling import load_spell_checker
+
+# (user input, expected correction)
+CASES = [
+    ("what is a kidny stone", "what is a kidney stone"),
+    ("waht causes kidney stnes", "what causes kidney stones"),
+    ("is a renal cist dangerous", "is a renal cyst dangerous"),
+    ("how is a kidney tumr treated", "how is a kidney tumor treated"),
+    ("what is hydronefrosis", "what is hydronephrosis"),
+    ("symptons of nephrolithiasis", "symptoms of nephrolithiasis"),
+    ("do i need lithotripsy", "do i need lithotripsy"),
+    ("what is ureteroscopy", "what is ureteroscopy"),
+    ("high creatinin level", "high creatinine level"),
+    ("what does nephrectomy mean", "what does nephrectomy mean"),
+    ("is pyelonephritis serius", "is pyelonephritis serious"),
+    ("polycistic kidney disease", "polycystic kidney disease"),
+    ("blood in urin", "blood in urine"),
+    ("calcium oxalte stones", "calcium oxalate stones"),
+    ("renal cell carcinona", "renal cell carcinoma"),
+    ("flank pian and fever", "flank pain and fever"),
+    ("can dialysis cure ckd", "can dialysis cure ckd"),
+    ("what is hematuria", "what is hematuria"),
+    ("treatment for kidney cancr", "treatment for kidney cancer"),
+    ("nephrologist near me", "nephrologist near me"),
+]
+
+# Ordinary English that a domain-only dictionary used to rewrite
+# (find -> fluid, nearest -> terrestris, best -> test, ...)
+GENERAL_CASES = [
+    ("find the nearest hospital", "find the nearest hospital"),
+    ("what is the best diet for me", "what is the best diet for me"),
+    ("can i live with one kidney", "can i live with one kidney"),
+    ("how are you doing today", "how are you doing today"),
+    ("my lower back hurts", "my lower back hurts"),
+    ("should i see a doctor tomorrow", "should i see a doctor tomorrow"),
+    ("is coffee bad for my kidneys", "is coffee bad for my kidneys"),
+    ("thanks that was helpful", "thanks that was helpful"),
+    ("where can i get a second opinion", "where can i get a second opinion"),
+    ("how long does recovery take after surgery", "how long does recovery take after surgery"),
+    ("what shuold i eat", "what should i eat"),
+    ("i feel tierd all the time", "i feel tired all the time"),
+]
+
+# Compared exactly: acronyms and mixed-case lab names are never looked up,
+# and a corrected word keeps the capitalization it was typed with
+CASING_CASES = [
+    ("Whats my eGFR", "Whats my eGFR"),
+    ("what does a low egfr mean", "what does a low egfr mean"),
+    ("Is my GFR normal", "Is my GFR normal"),
+    ("My BUN and PSA are high", "My BUN and PSA are high"),
+    ("is HbA1c related to CKD", "is HbA1c related to CKD"),
+    ("high wbc in urin", "high wbc in urine"),
+    ("Kidny stone pain", "Kidney stone pain"),
+    ("Doesnt ESRD need dialysis", "Doesnt ESRD need dialysis"),
+]
+
+
+def _textblob_correct():
+    try:
+        from textblob import TextBlob
+    except ImportError:
+        return None
+    return lambda text: str(TextBlob(text).correct())
+
+
+def run(name, correct, repeat, cases=CASES, exact=False):
+    timings = []
+    correct_count = 0
+    for text, expected in cases:
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = correct(text)
+            timings.append(time.perf_counter() - start)
+        correct_count += (result if exact else result.lower()) == expected
+    timings.sort()
+    print(f"{name:>20}: accuracy {correct_count}/{len(cases)}, "
+          f"p50 {1000 * statistics.median(timings):.3f} ms, "
+          f"p95 {1000 * timings[int(0.95 * (len(timings) - 1))]:.3f} ms")
+    return correct_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    checker = load_spell_checker()
+    print(f"symspell index load: {1000 * (time.perf_counter() - start):.1f} ms ({len(checker.words)} words)")
+
+    # Uncached: the per-token cache would otherwise hide the lookup cost
+    uncached = lambda t: (checker.lookup.cache_clear(), checker.correct(t))[1]
+    run("symspell", uncached, args.repeat)
+    run("symspell+lru", checker.correct, args.repeat)
+    run("symspell general", uncached, args.repeat, GENERAL_CASES)
+    run("symspell casing", uncached, args.repeat, CASING_CASES, exact=True)
+
+    textblob = _textblob_correct()
+    if textblob is None:
+        print("            textblob: not installed, skipped")
+    else:
+        run("textblob", textblob, max(1, args.repeat // 10))
+        run("textblob general", textblob, max(1, args.repeat // 10), GENERAL_CASES)
+        run("textblob casing", textblob, max(1, args.repeat // 10), CASING_CASES, exact=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# benchmarks/standins.py
+"""
+Synthetic inputs and stand-in models for the benchmark suite, so it runs
+offline and without the real checkpoints.
+
+Stand-ins keep the compute shape of the real models where that is cheap to
+do (ResNet-18 with the same head and random weights, YOLOv8n built from its
+yaml), and replace the rest with deterministic substitutes: a hashing
+embedder instead of all-MiniLM-L6-v2 (so chat numbers exclude the
+transformer encode) and a random forest trained on synthetic panels.
+install() must run before anything imports `app`; pass --real-models to the
+scripts to benchmark the real checkpoints instead.
+"""
+import io
+import os
+import zlib
+
+import numpy as np
+
+EMBEDDING_DIM = 384
+
+CHAT_QUESTIONS = [
+    "what is a kidney stone",
+    "how are kidney stones treated",
+    "what foods should I avoid with kidney stones",
+    "is a renal cyst dangerous",
+    "what are the symptoms of kidney cancer",
+    "how much water should I drink every day",
+    "what does the kidney do",
+    "find a nephrologist near me",
+    "what is hydronephrosis",
+    "can dialysis cure chronic kidney disease",
+    "what causes blood in urine",
+    "are there herbal remedies for kidney stones",
+]
+
+
+def configure_environment(workdir):
+    """Point every relative output path (static/, cache/) at `workdir` and defer model loading."""
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ["NEPHROSCAN_PRELOAD"] = "0"
+
+
+def synthetic_scan(seed, size=512):
+    """CT-like RGB uint8 slice: body outline, two kidneys, noise and a few bright foci."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    image = np.full((size, size), 20.0, dtype=np.float32)
+    image[((xx - 0.5) / 0.42) ** 2 + ((yy - 0.5) / 0.36) ** 2 <= 1.0] = 90.0
+    for cx in (0.33, 0.67):
+        cx += rng.uniform(-0.03, 0.03)
+        cy = 0.5 + rng.uniform(-0.05, 0.05)
+        image[((xx - cx) / 0.07) ** 2 + ((yy - cy) / 0.11) ** 2 <= 1.0] = 150.0
+    for _ in range(rng.integers(0, 4)):
+        cx, cy, r = rng.uniform(0.25, 0.75), rng.uniform(0.35, 0.65), rng.uniform(0.005, 0.02)
+        image[(xx - cx) ** 2 + (yy - cy) ** 2 <= r ** 2] = 250.0
+    image += rng.normal(0.0, 8.0, size=image.shape)
+    gray = np.clip(image, 0, 255).astype(np.uint8)
+    return np.stack([gray] * 3, axis=-1)
+
+
+def synthetic_upload(seed, size=512):
+    """PNG bytes of a synthetic scan; distinct seeds defeat the result cache."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(synthetic_scan(seed, size)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def synthetic_panels(n, seed=0):
+    """Random urine panels inside the accepted ranges, as a float (n, 6) matrix."""
+    from app.utils.risk_model import random_panels
+
+    return random_panels(n, seed)
+
+
+def panel_form(values):
+    from app.utils.risk_model import FEATURES
+
+    return {f: f"{v:.4g}" for f, v in zip(FEATURES, values)}
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder with the same output size as all-MiniLM-L6-v2."""
+
+    def encode(self, texts, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in text.lower().split():
+                h = zlib.crc32(token.encode("utf-8"))
+                vectors[i, h % EMBEDDING_DIM] += 1.0 if h & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+        return vectors[0] if single else vectors
+
+
+def standin_classifier():
+    """ResNet-18 with the production head and random weights (no ImageNet download)."""
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    torch.manual_seed(0)
+    net = models.resnet18(weights=None)
+    net.fc = nn.Sequential(
+        nn.Dropout(0.2),
+        nn.Linear(net.fc.in_features, 128),
+        nn.ReLU(),
+        nn.BatchNorm1d(128),
+        nn.Dropout(0.1),
+        nn.Linear(128, 4)
+    )
+    return net.eval()
+
+
+def standin_localizer():
+    """YOLOv8n built from its bundled yaml, randomly initialised."""
+    from ultralytics import YOLO
+
+    return YOLO("yolov8n.yaml")
+
+
+def standin_risk_model(n=5000, seed=0):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    X = synthetic_panels(n, seed)
+    rng = np.random.default_rng(seed + 1)
+    # Loosely follows the quiz explanations: concentrated, acidic or calcium-rich urine
+    y = ((X[:, 0] > 1.020) & (X[:, 1] < 6.0)) | (X[:, 5] > 5.0)
+    y ^= rng.random(n) < 0.05
+    scaler = StandardScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=100, random_state=seed).fit(scaler.transform(X), y.astype(int))
+    return model, scaler
+
+
+def install():
+    """Register stand-ins for every model that needs a checkpoint or a download."""
+    import faiss
+    from app.utils.model_registry import registry
+    from app.utils.compiled_forest import RoutedRiskPredictor, SklearnRiskPredictor, compile_forest
+
+    embedder = HashingEmbedder()
+    registry.override("classifier", standin_classifier())
+    registry.override("localizer", standin_localizer())
+    registry.override("embedder", embedder)
+
+    # Index the real RAG passages with the stand-in embedder
+    chunks = registry.get("rag_chunks")
+    index = faiss.IndexFlatL2(EMBEDDING_DIM)
+    index.add(embedder.encode([chunks[i] for i in range(len(chunks))]))
+    registry.override("faiss_index", index)
+
+    model, scaler = standin_risk_model()
+    registry.override("risk_model", model)
+    registry.override("risk_scaler", scaler)
+    reference = SklearnRiskPredictor(model, scaler)
+    if os.environ.get("NEPHROSCAN_RISK_BACKEND", "compiled") == "compiled":
+        registry.override("risk_predictor", RoutedRiskPredictor(compile_forest(model, scaler), reference))
+    else:
+        registry.override("risk_predictor", reference)
+
+    # spell_checker, rag_chunks, lexical_index and intent_router load for real
+    registry.load_all()
+    return registry
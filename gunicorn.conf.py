@@ -0,0 +1,79 @@
+# gunicorn.conf.py
+"""
+Pre-fork serving: the master imports the app and loads every model once,
+then forks workers that share the weights copy-on-write.
+
+    gunicorn -c gunicorn.conf.py
+
+Model weights are never written after loading, so their pages stay shared
+between the master and all workers; the FAISS index and RAG chunks are
+memory-mapped and shared through the page cache. What would otherwise
+unshare pages is the cyclic GC touching object headers, so the master runs
+with the GC off and freezes everything it built before each fork (see the
+gc.freeze() docs). Each worker logs its cold start time and RSS/PSS when it
+is ready; PSS is its real share of memory.
+
+Workers are gthread workers: each request runs on a real OS thread, so
+model inference, PDF rendering and the app's own thread pools (speculative
+localization, micro-batching, job and export workers) run in parallel and
+never stall other requests. Streaming responses are kept short instead: the
+job event stream closes after NEPHROSCAN_JOB_STREAM_SECONDS and EventSource
+resumes it with Last-Event-ID, and the chat stream lasts as long as its
+answer takes to produce. NEPHROSCAN_THREADS sets the threads per worker.
+
+State a follow-up request needs is shared between workers: analysis
+results, analysis and export jobs and their progress events are in the
+SQLite state store (app.utils.jobs), artifacts in their SQLite index, and
+the result and PDF caches on disk, so any worker can serve any request.
+What stays per worker (models, in-memory cache tiers, metrics, micro-batch
+queues) is only a cache or this worker's own statistics. The default is
+one worker per two cores, each with a matching share of torch threads.
+
+NEPHROSCAN_WORKERS, NEPHROSCAN_THREADS, NEPHROSCAN_TORCH_THREADS and
+NEPHROSCAN_BIND override the defaults below; NEPHROSCAN_PRELOAD=0 makes
+each worker load its own models lazily instead.
+"""
+import gc
+import os
+import sys
+
+# Must be set before the app is imported by the master
+os.environ.setdefault("NEPHROSCAN_PRELOAD", "1")
+# Warm-up runs single-threaded in the master: an OpenMP pool started before
+# fork() is not usable in the children. Workers set their own count below.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+wsgi_app = "run:app"
+bind = os.environ.get("NEPHROSCAN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("NEPHROSCAN_WORKERS", max(2, (os.cpu_count() or 1) // 2)))
+worker_class = "gthread"
+# Waiting on a stream or a batch costs a thread little, so allow more than cores
+threads = int(os.environ.get("NEPHROSCAN_THREADS", "8"))
+preload_app = os.environ["NEPHROSCAN_PRELOAD"] == "1"
+# Model loading happens in the master, so workers boot quickly
+timeout = 120
+graceful_timeout = 30
+
+TORCH_THREADS = int(os.environ.get("NEPHROSCAN_TORCH_THREADS", max(1, (os.cpu_count() or 1) // workers)))
+
+if preload_app:
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    # Picked up by torch on first import if the master did not load it
+    os.environ["OMP_NUM_THREADS"] = str(TORCH_THREADS)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(TORCH_THREADS)
+
+
+def post_worker_init(worker):
+    from app.utils.metrics import metrics
+
+    metrics.record_startup("worker")
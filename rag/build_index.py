@@ -0,0 +1,218 @@
+# rag/build_index.py
+"""
+Incremental, chunked builder for the chatbot's RAG index.
+
+Reads rag/index_documents.txt (one passage per line) and every .txt, .md
+and .pdf file under rag/documents/, splits them into overlapping word
+chunks, and embeds only the chunks whose content hash is not already in the
+embedding cache. The FAISS index type is chosen from the corpus size, and
+each build is written to a new rag/index/vNNNN/ directory with a manifest;
+rag/index/CURRENT is switched over only once the build is complete, and all
+but the newest --keep versions are then deleted.
+
+    python rag/build_index.py [--chunk-words 200] [--overlap 40] [--index-type auto] [--keep 2]
+"""
+import os
+import sys
+import json
+import math
+import hashlib
+import argparse
+from datetime import datetime
+
+import numpy as np
+import faiss
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.utils.rag_store import (INDEX_ROOT, CURRENT_PATH, INDEX_FILE, MANIFEST_FILE, LEXICAL_FILE, KEEP_VERSIONS,
+                                 current_version_dir, write_chunk_store, prune_versions)
+from app.utils.lexical import BM25Index
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+documents_dir = os.path.join(base_dir, "documents")
+passages_path = os.path.join(base_dir, "index_documents.txt")
+cache_vectors_path = os.path.join(INDEX_ROOT, "embedding_cache.npy")
+cache_hashes_path = os.path.join(INDEX_ROOT, "embedding_cache.txt")
+
+EMBEDDER_NAME = "all-MiniLM-L6-v2"
+FLAT_MAX = 10_000
+HNSW_MAX = 200_000
+
+
+def read_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        print(f"⚠️ pypdf is not installed, skipping {path}")
+        return ""
+    return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+
+def iter_documents():
+    """Yield (source, text) for every document in the corpus."""
+    with open(passages_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                yield f"index_documents.txt:{i + 1}", line.strip()
+
+    if not os.path.isdir(documents_dir):
+        return
+    for root, _, files in os.walk(documents_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            source = os.path.relpath(path, base_dir).replace("\\", "/")
+            if name.lower().endswith((".txt", ".md")):
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    yield source, f.read()
+            elif name.lower().endswith(".pdf"):
+                yield source, read_pdf(path)
+
+
+def chunk_text(text, chunk_words, overlap):
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def load_embedding_cache():
+    if not (os.path.exists(cache_vectors_path) and os.path.exists(cache_hashes_path)):
+        return {}
+    vectors = np.load(cache_vectors_path)
+    with open(cache_hashes_path, "r", encoding="utf-8") as f:
+        hashes = [line.strip() for line in f]
+    return dict(zip(hashes, vectors))
+
+
+def save_embedding_cache(cache):
+    hashes = list(cache)
+    np.save(cache_vectors_path, np.stack([cache[h] for h in hashes]).astype(np.float32))
+    with open(cache_hashes_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(hashes) + "\n")
+
+
+def choose_index_type(n):
+    if n <= FLAT_MAX:
+        return "flat"
+    if n <= HNSW_MAX:
+        return "hnsw"
+    return "ivfpq"
+
+
+def build_faiss_index(vectors, index_type):
+    n, d = vectors.shape
+    params = {}
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type == "hnsw":
+        params = {"M": 32, "efConstruction": 200, "efSearch": 64}
+        index = faiss.IndexHNSWFlat(d, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+        index.hnsw.efSearch = params["efSearch"]
+    elif index_type == "ivfpq":
+        nlist = int(4 * math.sqrt(n))
+        m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if d % m == 0)
+        params = {"nlist": nlist, "m": m, "nbits": 8, "nprobe": min(32, nlist)}
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, m, params["nbits"])
+        sample = vectors[np.random.default_rng(0).choice(n, size=min(n, 256 * nlist), replace=False)]
+        index.train(sample)
+        index.nprobe = params["nprobe"]
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'")
+    index.add(vectors)
+    return index, params
+
+
+def next_version():
+    existing = [d for d in os.listdir(INDEX_ROOT) if d.startswith("v") and d[1:].isdigit()]
+    return f"v{max([int(d[1:]) for d in existing], default=0) + 1:04d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chatbot RAG index incrementally")
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--overlap", type=int, default=40)
+    parser.add_argument("--index-type", choices=["auto", "flat", "hnsw", "ivfpq"], default="auto")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="Index versions to keep, including the new one")
+    args = parser.parse_args()
+
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+
+    # Chunk the corpus and hash every chunk
+    texts, chunks = [], []
+    for source, text in iter_documents():
+        for position, chunk in enumerate(chunk_text(text, args.chunk_words, args.overlap)):
+            digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+            chunks.append({"id": len(texts), "source": source, "position": position, "hash": digest})
+            texts.append(chunk)
+    if not texts:
+        print("❌ No documents found")
+        return
+
+    # Embed only chunks that are new or changed since the last build
+    cache = load_embedding_cache()
+    missing = {}
+    for chunk, text in zip(chunks, texts):
+        if chunk["hash"] not in cache:
+            missing[chunk["hash"]] = text
+    print(f"{len(texts)} chunks, {len(texts) - len(missing)} cached, {len(missing)} to embed")
+    if missing:
+        model = SentenceTransformer(EMBEDDER_NAME)
+        hashes = list(missing)
+        vectors = model.encode([missing[h] for h in hashes], batch_size=args.batch_size, show_progress_bar=True)
+        cache.update(zip(hashes, np.asarray(vectors, dtype=np.float32)))
+
+    vectors = np.stack([cache[c["hash"]] for c in chunks]).astype(np.float32)
+    index_type = choose_index_type(len(texts)) if args.index_type == "auto" else args.index_type
+    index, params = build_faiss_index(vectors, index_type)
+
+    # Write the new version, then flip CURRENT
+    version = next_version()
+    version_dir = os.path.join(INDEX_ROOT, version)
+    os.makedirs(version_dir)
+    faiss.write_index(index, os.path.join(version_dir, INDEX_FILE))
+    write_chunk_store(version_dir, texts, [c["source"] for c in chunks])
+    # Lexical fast path is built over the same chunk ids
+    BM25Index.build(texts).save(os.path.join(version_dir, LEXICAL_FILE))
+    previous = current_version_dir()
+    manifest = {
+        "version": version,
+        "previous": os.path.basename(previous) if previous else None,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "embedder": EMBEDDER_NAME,
+        "dimension": int(vectors.shape[1]),
+        "index_type": index_type,
+        "index_params": params,
+        "chunk_words": args.chunk_words,
+        "overlap": args.overlap,
+        "num_chunks": len(texts),
+        "chunks": chunks,
+    }
+    with open(os.path.join(version_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    # Keep only embeddings still referenced by the corpus
+    save_embedding_cache({c["hash"]: cache[c["hash"]] for c in chunks})
+
+    tmp_path = CURRENT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, CURRENT_PATH)
+    removed = prune_versions(args.keep)
+
+    print(f"✅ Built {index_type} index {version} with {len(texts)} chunks in rag/index/"
+          + (f" (removed {', '.join(removed)})" if removed else ""))
+
+
+if __name__ == "__main__":
+    main()